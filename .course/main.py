@@ -5,35 +5,132 @@ import json
 import uvicorn
 import socket
 import webbrowser
-import threading
 import time
-from telethon import TelegramClient
+import gzip
+import hashlib
+import struct
+import bisect
+import sqlite3
+import secrets
+import subprocess
+import shutil
+import urllib.request
+from urllib.parse import quote
+from html import escape
+from collections import OrderedDict, deque
+from telethon import TelegramClient, functions, types, errors, events, utils
 from telethon.sessions import StringSession
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
 from fastapi import FastAPI, Response, Request
-from fastapi.responses import StreamingResponse, HTMLResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse
 import re
 from contextlib import asynccontextmanager
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # --- PATH CONFIGURATION ---
 BASE_DIR = os.path.expanduser("~/.course")
 COURSES_FILE = os.path.join(BASE_DIR, "courses.json")
+LIBRARY_FILE = os.path.join(BASE_DIR, "library.db")
 SESSION_FILE = os.path.join(BASE_DIR, "session.txt")
+SESSIONS_FILE = os.path.join(BASE_DIR, "sessions.json")
+INDEX_DIR = os.path.join(BASE_DIR, "indexes")
+CONFIG_FILE = os.path.join(BASE_DIR, "config.json")
+CHUNK_CACHE_DIR = os.path.join(BASE_DIR, "cache", "chunks")
+BOX_CACHE_DIR = os.path.join(BASE_DIR, "cache", "boxes")
+THUMB_CACHE_DIR = os.path.join(BASE_DIR, "cache", "thumbs")
+MIRROR_DIR = os.path.join(BASE_DIR, "mirror")
+DAEMON_FILE = os.path.join(BASE_DIR, "daemon.json")
+DAEMON_LOG = os.path.join(BASE_DIR, "daemon.log")
+TRACE_LOG = os.path.join(BASE_DIR, "trace.jsonl")
+
+# --- SETTINGS (overridable in config.json) ---
+CONFIG = {
+    "cache_size_mb": 2048,
+    "download_connections": 4,
+    "prefetch_ahead_mb": 16,
+    "next_lesson_mb": 8,
+    "streams_per_lesson": 2,
+    "abort_on_disconnect": True,
+    "scan_shard_size": 1000,
+    "scan_concurrency": 4,
+    "idle_course_minutes": 30,
+    "max_loaded_courses": 8,
+    "upstream_rps": 40,
+    "upstream_concurrency": 12,
+    "flood_wait_max": 60,
+    "download_workers": 3,
+    "thumb_concurrency": 2,
+    "progress_flush_seconds": 5,
+    "trace_requests": False,
+}
+CHUNK_SIZE = 1024 * 1024
+PART_SIZE = 512 * 1024
 
 # --- GLOBAL VARIABLES ---
 API_ID = None 
 API_HASH = None
-CHANNEL_INPUT = None
+COURSE_KEY = None
 
 # --- GLOBAL STATE ---
 CURRENT_PORT = 8000
 client = None
-target_entity = None
-course_structure = {}
+library_db = None
+courses = {}
+chunk_lru = OrderedDict()
+CACHE_STATS = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+session_pool = []
+prefetchers = {}
+active_streams = {}
+inflight_chunks = {}
+STREAM_STATS = {"bytes_fetched": 0, "bytes_served": 0, "bytes_wasted": 0, "aborted": 0, "coalesced": 0, "box_hits": 0, "errors": 0}
+INDEX_STATS = {"messages_scanned": 0, "runs": 0}
+histograms = {}
+trace_file = None
+thumb_jobs = {}
+janitor = None
+progress_writer = None
+progress_pending = {}
+daemon_server = None
+daemon_token = None
 
 # --- HELPER: LOGGING ---
 def log(msg):
     print(f"[TeloView] {msg}")
 
+# --- HELPER: METRICS & TRACING ---
+# Latency histograms for /metrics, kept as plain dicts: (name, labels) -> per-bucket counts, sum and count.
+# observe() is a bisect and a few additions, cheap enough for every chunk and every RPC.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    hist = histograms.get(key)
+    if hist is None: hist = histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+    slot = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    if slot < len(LATENCY_BUCKETS): hist["buckets"][slot] += 1
+    hist["sum"] += seconds
+    hist["count"] += 1
+
+# One JSON line per event in trace.jsonl, only with trace_requests on
+def trace(event, **fields):
+    global trace_file
+    if not CONFIG["trace_requests"]: return
+    if trace_file is None: trace_file = open(TRACE_LOG, "a", buffering=1)
+    trace_file.write(json.dumps({"ts": round(time.time(), 3), "event": event, **fields}) + "\n")
+
+# --- HELPER: LOAD SETTINGS ---
+def load_config():
+    if not os.path.exists(CONFIG_FILE): return
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            CONFIG.update(json.load(f))
+    except Exception as e:
+        log(f"⚠️ config.json ignored: {e}")
+
 # --- HELPER: FIND FREE PORT ---
 def get_free_port(start_port=8000):
     port = start_port
@@ -43,45 +140,203 @@ def get_free_port(start_port=8000):
                 return port
             port += 1
 
-# --- HELPER: AUTO OPEN BROWSER ---
-def trigger_browser():
-    # Uses global CURRENT_PORT to ensure correct link opens
-    url = f"http://localhost:{CURRENT_PORT}"
-    log(f"🚀 Opening Browser: {url}")
-    webbrowser.open(url)
-
-# --- HELPER: SEARCH COURSES ---
-def load_and_search_courses(keyword):
-    if not os.path.exists(COURSES_FILE): return []
-    matches = []
+# --- HELPER: COURSE LIBRARY (SQLITE) ---
+# library.db keeps every course plus FTS5 indexes over course metadata and every lesson title. Lesson rows
+# are copied from the saved course indexes, only for courses whose index file changed since the last search.
+# courses.json still works as an import file: its entries are merged in whenever it changes on disk,
+# and courses it imported earlier but no longer lists are removed (courses added with the wizard stay).
+LIBRARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS courses (id INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, title TEXT, author TEXT, info TEXT NOT NULL, indexed REAL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS lessons (id INTEGER PRIMARY KEY, course_id INTEGER NOT NULL, msg_id INTEGER NOT NULL, title TEXT, module TEXT, course TEXT);
+CREATE INDEX IF NOT EXISTS lessons_course ON lessons (course_id);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS progress (course TEXT NOT NULL, msg_id INTEGER NOT NULL, position REAL, duration REAL, done INTEGER, updated REAL, PRIMARY KEY (course, msg_id));
+CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5 (key, title, author, content='courses', content_rowid='id', prefix='1 2 3');
+CREATE VIRTUAL TABLE IF NOT EXISTS lesson_search USING fts5 (title, module, course, content='lessons', content_rowid='id', prefix='1 2 3');
+CREATE TRIGGER IF NOT EXISTS courses_ai AFTER INSERT ON courses BEGIN
+    INSERT INTO course_search (rowid, key, title, author) VALUES (new.id, new.key, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS courses_au AFTER UPDATE OF key, title, author ON courses BEGIN
+    INSERT INTO course_search (course_search, rowid, key, title, author) VALUES ('delete', old.id, old.key, old.title, old.author);
+    INSERT INTO course_search (rowid, key, title, author) VALUES (new.id, new.key, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS courses_ad AFTER DELETE ON courses BEGIN
+    INSERT INTO course_search (course_search, rowid, key, title, author) VALUES ('delete', old.id, old.key, old.title, old.author);
+END;
+"""
+
+def open_library():
+    global library_db
+    if library_db: return library_db
+    os.makedirs(BASE_DIR, exist_ok=True)
+    library_db = sqlite3.connect(LIBRARY_FILE, timeout=10)
+    library_db.execute("PRAGMA journal_mode=WAL")
+    library_db.execute("PRAGMA synchronous=NORMAL")
+    library_db.executescript(LIBRARY_SCHEMA)
+    import_courses_file(library_db)
+    return library_db
+
+def import_courses_file(db):
+    if not os.path.exists(COURSES_FILE): return
+    mtime = os.path.getmtime(COURSES_FILE)
+    row = db.execute("SELECT value FROM meta WHERE name = 'courses_json_mtime'").fetchone()
+    if row and row[0] == mtime: return
     try:
-        with open(COURSES_FILE, 'r') as f:
-            data = json.load(f)
-        keyword = keyword.lower()
-        for key, info in data.items():
-            search_text = f"{key} {info.get('title', '')} {info.get('author', '')}".lower()
-            if keyword in search_text:
-                matches.append((key, info))
+        with open(COURSES_FILE, 'r') as f: data = json.load(f)
     except Exception as e:
-        log(f"❌ JSON Error: {e}")
-    return matches
+        return log(f"❌ JSON Error: {e}")
+    row = db.execute("SELECT value FROM meta WHERE name = 'courses_json_keys'").fetchone()
+    imported = json.loads(row[0]) if row else []
+    with db:
+        for key, info in data.items():
+            save_course(key, {**(read_course(key) or {}), **info}, db)
+        for key in set(imported) - set(data):
+            delete_course(key, db)
+            log(f"🗑️ Removed course '{key}' (no longer in courses.json)")
+        db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('courses_json_mtime', ?)", (mtime,))
+        db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('courses_json_keys', ?)", (json.dumps(list(data)),))
+
+def read_courses():
+    rows = open_library().execute("SELECT key, info FROM courses ORDER BY id")
+    return {key: json.loads(info) for key, info in rows}
+
+def read_course(course_key):
+    row = open_library().execute("SELECT info FROM courses WHERE key = ?", (course_key,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def save_course(course_key, info, db=None):
+    db = db or open_library()
+    with db:
+        db.execute(
+            "INSERT INTO courses (key, title, author, info) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET title = excluded.title, author = excluded.author, info = excluded.info",
+            (course_key, info.get("title") or course_key, info.get("author") or "", json.dumps(info)),
+        )
+
+def delete_course(course_key, db=None):
+    db = db or open_library()
+    with db:
+        row = db.execute("SELECT id FROM courses WHERE key = ?", (course_key,)).fetchone()
+        if not row: return
+        db.execute(
+            "INSERT INTO lesson_search (lesson_search, rowid, title, module, course) "
+            "SELECT 'delete', id, title, module, course FROM lessons WHERE course_id = ?", row,
+        )
+        db.execute("DELETE FROM lessons WHERE course_id = ?", row)
+        db.execute("DELETE FROM courses WHERE id = ?", row)
+
+# Re-reads only the course indexes whose file changed (one transaction for all of them);
+# stat() per course keeps this cheap for big libraries. lesson_search is filled per course with
+# INSERT ... SELECT rather than row triggers, which is several times faster on big courses.
+def sync_lesson_search(db):
+    with db:
+        for course_id, course_key, title, indexed in db.execute("SELECT id, key, title, indexed FROM courses").fetchall():
+            path = index_path(course_key)
+            mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+            if mtime == indexed: continue
+            try:
+                with open(path, 'r') as f: records = json.load(f)["records"] if mtime else []
+            except Exception:
+                continue
+            rows, module = [], ""
+            for rec in records:
+                if "module" in rec: module = rec["module"]
+                else: rows.append((course_id, rec["id"], rec["title"], module, f"{title} {course_key}"))
+            db.execute(
+                "INSERT INTO lesson_search (lesson_search, rowid, title, module, course) "
+                "SELECT 'delete', id, title, module, course FROM lessons WHERE course_id = ?", (course_id,),
+            )
+            db.execute("DELETE FROM lessons WHERE course_id = ?", (course_id,))
+            db.executemany("INSERT INTO lessons (course_id, msg_id, title, module, course) VALUES (?, ?, ?, ?, ?)", rows)
+            db.execute(
+                "INSERT INTO lesson_search (rowid, title, module, course) "
+                "SELECT id, title, module, course FROM lessons WHERE course_id = ?", (course_id,),
+            )
+            db.execute("UPDATE courses SET indexed = ? WHERE id = ?", (mtime, course_id))
+
+# Every word must match, the last letters of each may be missing ("rea hoo" finds "React Hooks")
+def fts_query(keyword):
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", keyword.lower()))
+
+# Ranked matches as (key, info, lesson or None): an exact short id, else courses, else lessons of any course
+def search_library(keyword, limit=10):
+    db = open_library()
+    query = fts_query(keyword)
+    if not query: return [(key, info, None) for key, info in read_courses().items()]
+    rows = db.execute("SELECT key, info FROM courses WHERE key = ? COLLATE NOCASE", (keyword.strip(),)).fetchall()
+    if not rows:
+        rows = db.execute(
+            "SELECT c.key, c.info FROM course_search JOIN courses c ON c.id = course_search.rowid "
+            "WHERE course_search MATCH ? ORDER BY bm25(course_search, 10.0, 5.0, 1.0) LIMIT ?", (query, limit),
+        ).fetchall()
+    if rows: return [(key, json.loads(info), None) for key, info in rows]
+
+    sync_lesson_search(db)
+    rows = db.execute(
+        "SELECT c.key, c.info, l.msg_id, l.title FROM lesson_search JOIN lessons l ON l.id = lesson_search.rowid "
+        "JOIN courses c ON c.id = l.course_id WHERE lesson_search MATCH ? "
+        "ORDER BY bm25(lesson_search, 10.0, 3.0, 1.0), l.course_id, l.msg_id LIMIT ?", (query, limit),
+    ).fetchall()
+    return [(key, json.loads(info), {"id": msg_id, "title": title}) for key, info, msg_id, title in rows]
+
+# --- HELPER: WATCH PROGRESS ---
+# Players report progress every few seconds; reports only update progress_pending in memory and
+# write_progress stores the whole batch in one transaction every progress_flush_seconds (and on shutdown).
+def read_progress(course_key):
+    rows = open_library().execute("SELECT msg_id, position, duration, done FROM progress WHERE course = ?", (course_key,))
+    saved = {msg_id: {"position": position, "duration": duration, "done": bool(done)} for msg_id, position, duration, done in rows}
+    saved.update({msg_id: entry for (key, msg_id), entry in progress_pending.items() if key == course_key})
+    return saved
+
+def note_progress(course_key, msg_id, position, duration, done):
+    progress_pending[(course_key, msg_id)] = {"position": position, "duration": duration, "done": done}
+
+def flush_progress():
+    if not progress_pending: return
+    batch = [(key, msg_id, e["position"], e["duration"], int(e["done"]), time.time()) for (key, msg_id), e in progress_pending.items()]
+    progress_pending.clear()
+    db = open_library()
+    with db:
+        db.executemany("INSERT OR REPLACE INTO progress (course, msg_id, position, duration, done, updated) VALUES (?, ?, ?, ?, ?, ?)", batch)
+
+async def write_progress():
+    while True:
+        await asyncio.sleep(CONFIG["progress_flush_seconds"])
+        try:
+            flush_progress()
+        except sqlite3.Error as e:
+            log(f"⚠️ Could not save watch progress: {e}")
+
+# Asks which one when several match (best match first); returns (key, info, lesson) or (None, None, None)
+def choose_course(keyword):
+    print(f"🔎 Searching for: '{keyword}'...")
+    matches = search_library(keyword)
+    if not matches:
+        print(f"❌ No courses or lessons found for '{keyword}'. Use 'course-add' to create one.")
+        return None, None, None
+    if len(matches) == 1: return matches[0]
+
+    print("\n🤔 Multiple matches found. Which one?")
+    for i, (key, info, lesson) in enumerate(matches):
+        if lesson: print(f"   [{i+1}] {lesson['title']} (in {info.get('title')})")
+        else: print(f"   [{i+1}] {info.get('title')} (by {info.get('author')})")
+    try:
+        choice = input("\n👉 Enter number (1, 2...) [1]: ").strip() or "1"
+        return matches[int(choice) - 1]
+    except:
+        print("❌ Invalid selection.")
+        return None, None, None
 
 # --- HELPER: WIZARD ADD ---
 def wizard_add_course():
     print("\n✨ --- ADD NEW COURSE --- ✨")
     default_id = "25721571"
     default_hash = "3e6762dc02d94f4737178552060f2b57"
-    existing = {}
-    
-    if os.path.exists(COURSES_FILE):
-        try:
-            with open(COURSES_FILE, 'r') as f:
-                existing = json.load(f)
-                if existing:
-                    first = next(iter(existing.values()))
-                    default_id = first.get('api_id', default_id)
-                    default_hash = first.get('api_hash', default_hash)
-        except: pass
+    first = open_library().execute("SELECT info FROM courses ORDER BY id LIMIT 1").fetchone()
+    if first:
+        first = json.loads(first[0])
+        default_id = first.get('api_id', default_id)
+        default_hash = first.get('api_hash', default_hash)
 
     short_name = input("🔹 Short ID: ").strip()
     if not short_name: return print("❌ ID Required!")
@@ -96,19 +351,17 @@ def wizard_add_course():
     api_id = input(f"🔹 API ID: ").strip() or default_id
     api_hash = input(f"🔹 API Hash: ").strip() or default_hash
 
-    existing[short_name] = {
+    save_course(short_name, {
         "title": title, "author": author, 
         "api_id": api_id, "api_hash": api_hash, 
         "channel_link": link
-    }
-    
-    with open(COURSES_FILE, 'w') as f: json.dump(existing, f, indent=4)
+    })
     print(f"\n✅ Course '{title}' added! Try: play {short_name}\n")
 
 # --- HELPER: LIST COURSES ---
 def list_courses():
-    if not os.path.exists(COURSES_FILE): return print("📭 No courses.")
-    with open(COURSES_FILE) as f: data = json.load(f)
+    data = read_courses()
+    if not data: return print("📭 No courses.")
     print("\n📚 --- YOUR LIBRARY ---")
     print(f"{'ID':<20} | {'AUTHOR':<15} | {'TITLE'}")
     print("-" * 70)
@@ -140,68 +393,772 @@ def clean_title(name):
     name = re.sub(r'^[-_|\s]+', '', name)
     return name.strip()
 
+# --- HELPER: COURSE INDEX (PERSISTED) ---
+def index_path(course_key):
+    safe_key = re.sub(r'[^\w.-]+', '_', str(course_key))
+    return os.path.join(INDEX_DIR, f"{safe_key}.json")
+
+def load_course_index(course_key, channel):
+    # Returns a blank index when nothing is saved or the course now points at another channel
+    blank = {"channel": channel, "max_id": 0, "records": []}
+    path = index_path(course_key)
+    if not os.path.exists(path): return blank
+    try:
+        with open(path, 'r') as f:
+            index = json.load(f)
+        if index.get("channel") != channel: return blank
+        return index
+    except Exception as e:
+        log(f"⚠️ Index unreadable, rebuilding: {e}")
+        return blank
+
+def save_course_index(course_key, index):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    path = index_path(course_key)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f: json.dump(index, f)
+    os.replace(tmp_path, path)
+
+def drop_course_index(course_key):
+    path = index_path(course_key)
+    if os.path.exists(path): os.remove(path)
+
+# Compact, JSON-safe form of a message: a module header, a video lesson, or None
+def message_record(msg):
+    if not (msg.media or (msg.message and "MODULE:" in msg.message.upper())): return None
+    if msg.message and not msg.media:
+        text = msg.message.strip()
+        if "MODULE:" in text.upper() or (len(text) < 60 and not text.startswith("http")):
+            clean_name = text.replace("MODULE:", "").replace("Module:", "").strip()
+            clean_name = re.sub(r'^[-_|\s]+', '', clean_name)
+            return {"id": msg.id, "module": clean_name}
+
+    elif msg.media and msg.file:
+        mime_type = getattr(msg.file, 'mime_type', None) or ""
+        if mime_type.startswith('video/'):
+            raw_name = getattr(msg.file, 'name', None)
+            if not raw_name: raw_name = f"Lesson {msg.id}"
+            rec = {"id": msg.id, "title": clean_title(raw_name), "size": msg.file.size, "mime": mime_type}
+            doc = getattr(msg.media, 'document', None)
+            if doc:
+                rec["doc"] = [doc.id, doc.access_hash, doc.file_reference.hex(), doc.dc_id]
+                rec["thumb"] = thumb_type(doc)
+            return rec
+    return None
+
+# Every change to a course's structure goes through here so cached pages know to re-render
+def publish_structure(course, structure):
+    course["structure"] = structure
+    course["version"] += 1
+    notify_listeners(course)
+
+def set_index_status(course, **status):
+    course["status"].update(status)
+    notify_listeners(course)
+
+# Wakes every /api/events stream of the course waiting on the current event
+def notify_listeners(course):
+    course["changed"].set()
+    course["changed"] = asyncio.Event()
+
+def build_structure(records):
+    current_module = "Course Content"
+    structure = {current_module: []}
+    for rec in records:
+        if "module" in rec:
+            current_module = rec["module"]
+            if current_module not in structure:
+                structure[current_module] = []
+        else:
+            structure[current_module].append(rec)
+    return {k: v for k, v in structure.items() if v}
+
+# One slice (lo, hi] of the message id space, oldest first, reduced to compact records
+async def scan_shard(entity, lo, hi):
+    async def scan():
+        records = []
+        async for msg in client.iter_messages(entity, min_id=lo, max_id=hi + 1, reverse=True):
+            INDEX_STATS["messages_scanned"] += 1
+            rec = message_record(msg)
+            if rec: records.append(rec)
+        return records
+    return await upstream("indexing", scan, cost=max(1, (hi - lo) // 100))
+
+# Splits the ids above the high-water mark into scan_shard_size slices and scans scan_concurrency of them at once.
+# Shards are merged strictly in id order, so grouping matches a sequential scan and max_id only moves past
+# fully merged shards (the index stays consistent if the scan stops early).
+# on_batch gets fresh records at the first lesson and then about twice a second, for progressive publishing.
+# Records past max_id came from live events (see on_live_event); the scan below brings back the ones still posted.
+# Fetches only messages newer than the stored high-water mark (everything on a blank index)
+async def sync_course_index(entity, index, on_batch=None, latest=None):
+    if latest is None: latest = await upstream("indexing", lambda: client.get_messages(entity, limit=1))
+    top = latest[0].id if latest else 0
+    if index["records"] and index["records"][-1]["id"] > index["max_id"]:
+        index["records"] = [rec for rec in index["records"] if rec["id"] <= index["max_id"]]
+    if top <= index["max_id"]: return
+
+    shard_size = CONFIG["scan_shard_size"]
+    bounds = [(lo, min(lo + shard_size, top)) for lo in range(index["max_id"], top, shard_size)]
+    slots = asyncio.Semaphore(CONFIG["scan_concurrency"])
+    async def run_shard(lo, hi):
+        async with slots: return await scan_shard(entity, lo, hi)
+
+    tasks = [asyncio.create_task(run_shard(lo, hi)) for lo, hi in bounds]
+    fresh, last_batch = [], None
+    try:
+        for task, (lo, hi) in zip(tasks, bounds):
+            records = await task
+            index["records"].extend(records)
+            index["max_id"] = hi
+            fresh.extend(records)
+            has_lesson = any("title" in rec for rec in fresh)
+            if on_batch and fresh and ((last_batch is None and has_lesson) or (last_batch and time.monotonic() - last_batch >= 0.5)):
+                on_batch(fresh)
+                fresh, last_batch = [], time.monotonic()
+    finally:
+        for task in tasks: task.cancel()
+    if on_batch and fresh: on_batch(fresh)
+
+# --- HELPER: CHANNEL PEER CACHE ---
+# The resolved channel (id + access hash) is kept in the course entry in the library,
+# so later launches skip get_entity / iter_dialogs entirely
+def load_course_peer(course_key, link):
+    try:
+        peer = (read_course(course_key) or {}).get("peer")
+        return peer if peer and peer.get("link") == link else None
+    except Exception:
+        return None
+
+def save_course_peer(course_key, link, entity):
+    if not isinstance(entity, types.Channel): return
+    try:
+        info = read_course(course_key)
+        if not info: return
+        info["peer"] = {"id": entity.id, "access_hash": entity.access_hash, "title": entity.title, "link": link}
+        save_course(course_key, info)
+    except Exception as e:
+        log(f"⚠️ Could not save channel peer: {e}")
+
+# Returns (entity, latest message list or None). A saved peer is used as-is; the get_messages call that
+# the index sync needs anyway doubles as the check, and only a rejected peer falls back to a full lookup.
+async def resolve_target(course):
+    peer = load_course_peer(course["key"], course["link"])
+    if peer:
+        entity = types.InputPeerChannel(peer["id"], peer["access_hash"])
+        try:
+            latest = await upstream("indexing", lambda: client.get_messages(entity, limit=1))
+            course["channel_id"], course["channel_title"] = peer["id"], peer.get("title")
+            return entity, latest
+        except (errors.RPCError, ValueError) as e:
+            log(f"⚠️ Saved channel peer rejected ({e}), resolving again...")
+
+    identifier = await resolve_channel(course["link"])
+    async def find_dialog():
+        async for dialog in client.iter_dialogs():
+            if dialog.id == identifier or str(dialog.id).endswith(str(identifier).replace("-100", "")):
+                return dialog.entity
+    entity = None
+    try:
+        entity = await upstream("indexing", lambda: client.get_entity(identifier))
+    except ValueError:
+        entity = await upstream("indexing", find_dialog, cost=5)
+    if not entity: raise Exception("Channel not found!")
+    course["channel_id"], course["channel_title"] = entity.id, getattr(entity, 'title', None)
+    save_course_peer(course["key"], course["link"], entity)
+    return entity, None
+
+# --- HELPER: LESSON MEDIA CACHE ---
+# Per course, msg_id -> {"location", "dc_id", "size", "mime"}: enough to download without a get_messages round trip
+def media_entry(doc_id, access_hash, file_reference, dc_id, size, mime_type):
+    location = types.InputDocumentFileLocation(id=doc_id, access_hash=access_hash, file_reference=file_reference, thumb_size='')
+    return {"location": location, "dc_id": dc_id, "size": size, "mime": mime_type}
+
+def load_lesson_media(course, records):
+    for rec in records:
+        if "doc" in rec:
+            doc_id, access_hash, file_ref, dc_id = rec["doc"]
+            course["media"][rec["id"]] = media_entry(doc_id, access_hash, bytes.fromhex(file_ref), dc_id, rec["size"], rec["mime"])
+            if "boxes" in rec: course["media"][rec["id"]]["boxes"] = rec["boxes"]
+            if "thumb" in rec: course["media"][rec["id"]]["thumb"] = rec["thumb"]
+
+async def fetch_lesson_media(course, msg_id, kind="playback"):
+    if course["entity"] is None: return None
+    msg = await upstream(kind, lambda: client.get_messages(course["entity"], ids=msg_id))
+    doc = getattr(getattr(msg, 'media', None), 'document', None) if msg else None
+    if not isinstance(doc, types.Document): return None
+    entry = media_entry(doc.id, doc.access_hash, doc.file_reference, doc.dc_id, doc.size, doc.mime_type)
+    entry["thumb"] = thumb_type(doc)
+    lesson_media = course["media"]
+    if msg_id in lesson_media:
+        lesson_media[msg_id].update(entry)
+    else:
+        lesson_media[msg_id] = entry
+    index = course["index"]
+    for rec in (index or {}).get("records", []):
+        if rec["id"] == msg_id and "title" in rec:
+            rec["doc"] = [doc.id, doc.access_hash, doc.file_reference.hex(), doc.dc_id]
+            rec["thumb"] = entry["thumb"]
+            index["dirty"] = True
+    return lesson_media[msg_id]
+
+async def get_lesson_media(course, msg_id, kind="playback"):
+    if msg_id in course["media"]: return course["media"][msg_id]
+    return await fetch_lesson_media(course, msg_id, kind)
+
+# File references expire after a while; concurrent failures on one lesson share a single refetch
+async def refresh_lesson_media(course, msg_id, kind="playback"):
+    refreshes = course["refreshes"]
+    if msg_id not in refreshes:
+        refreshes[msg_id] = asyncio.ensure_future(fetch_lesson_media(course, msg_id, kind))
+        refreshes[msg_id].add_done_callback(lambda _: refreshes.pop(msg_id, None))
+    return await asyncio.shield(refreshes[msg_id])
+
+# --- HELPER: LESSON THUMBNAILS ---
+# Telegram keeps a few JPEG previews with each video; the sidebar shows the largest one. They are fetched when
+# a row first comes into view and kept for good under cache/thumbs/<doc id>.jpg (a new upload is a new doc id).
+def thumb_type(doc):
+    sizes = [t for t in doc.thumbs or [] if isinstance(t, types.PhotoSize)]
+    return max(sizes, key=lambda t: t.w * t.h).type if sizes else None
+
+def thumb_path(doc_id):
+    return os.path.join(THUMB_CACHE_DIR, f"{doc_id}.jpg")
+
+# Lessons indexed before thumbnails were tracked learn their thumbnail type with one message refetch
+async def fetch_thumb(course, msg_id):
+    media = await get_lesson_media(course, msg_id, "thumbs")
+    if media and "thumb" not in media: media = await refresh_lesson_media(course, msg_id, "thumbs")
+    if not media or not media.get("thumb"): return None
+    path = thumb_path(media["location"].id)
+    if os.path.exists(path): return path
+    for attempt in range(2):
+        location = media["location"]
+        thumb = types.InputDocumentFileLocation(id=location.id, access_hash=location.access_hash, file_reference=location.file_reference, thumb_size=media["thumb"])
+        try:
+            data = await upstream("thumbs", lambda: client.download_file(thumb, bytes, dc_id=media["dc_id"]))
+            break
+        except (errors.FileReferenceExpiredError, errors.FileReferenceInvalidError):
+            media = await refresh_lesson_media(course, msg_id, "thumbs")
+            if not media or attempt: raise
+    os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+    with open(path + ".tmp", 'wb') as f: f.write(data)
+    os.replace(path + ".tmp", path)
+    return path
+
+# The same row can be rendered again before its first request is answered; both wait on one download
+async def get_thumb(course, msg_id):
+    job_key = (course["key"], msg_id)
+    if job_key not in thumb_jobs:
+        thumb_jobs[job_key] = asyncio.ensure_future(fetch_thumb(course, msg_id))
+        thumb_jobs[job_key].add_done_callback(lambda _: thumb_jobs.pop(job_key, None))
+    return await asyncio.shield(thumb_jobs[job_key])
+
+# --- HELPER: CHUNK CACHE (DISK, LRU) ---
+# Layout: cache/chunks/<document id>/<chunk index>, only fetched chunks exist on disk.
+# Keyed by document, which is known from the saved index before the channel is resolved
+def chunk_path(key):
+    doc_id, idx = key
+    return os.path.join(CHUNK_CACHE_DIR, str(doc_id), str(idx))
+
+def init_chunk_cache():
+    chunk_lru.clear()
+    CACHE_STATS["bytes"] = 0
+    if not os.path.isdir(CHUNK_CACHE_DIR): return
+    found = []
+    for doc_dir in os.scandir(CHUNK_CACHE_DIR):
+        if not doc_dir.is_dir(): continue
+        for entry in os.scandir(doc_dir.path):
+            # <channel>/<msg_id>/ folders from the old layout can't be matched to a document, drop them
+            if entry.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            if not entry.name.isdigit(): continue
+            st = entry.stat()
+            found.append((st.st_mtime, (int(doc_dir.name), int(entry.name)), st.st_size))
+    for _, key, size in sorted(found):
+        chunk_lru[key] = size
+        CACHE_STATS["bytes"] += size
+    evict_chunks()
+    log(f"💾 Chunk cache: {len(chunk_lru)} chunks, {CACHE_STATS['bytes'] / 1048576:.0f} MB")
+
+def evict_chunks():
+    limit = CONFIG["cache_size_mb"] * 1024 * 1024
+    while chunk_lru and CACHE_STATS["bytes"] > limit:
+        key, size = chunk_lru.popitem(last=False)
+        CACHE_STATS["bytes"] -= size
+        CACHE_STATS["evictions"] += 1
+        try:
+            os.remove(chunk_path(key))
+            os.rmdir(os.path.dirname(chunk_path(key)))
+        except OSError: pass
+
+def cache_get(key):
+    if key not in chunk_lru:
+        CACHE_STATS["misses"] += 1
+        return None
+    try:
+        with open(chunk_path(key), 'rb') as f: data = f.read()
+        os.utime(chunk_path(key))
+    except OSError:
+        CACHE_STATS["bytes"] -= chunk_lru.pop(key)
+        CACHE_STATS["misses"] += 1
+        return None
+    chunk_lru.move_to_end(key)
+    CACHE_STATS["hits"] += 1
+    return data
+
+def drop_lesson_chunks(doc_id):
+    for key in [key for key in chunk_lru if key[0] == doc_id]:
+        CACHE_STATS["bytes"] -= chunk_lru.pop(key)
+        try: os.remove(chunk_path(key))
+        except OSError: pass
+
+def cache_put(key, data):
+    path = chunk_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f: f.write(data)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        return log(f"⚠️ Cache write failed: {e}")
+    CACHE_STATS["bytes"] += len(data) - chunk_lru.pop(key, 0)
+    chunk_lru[key] = len(data)
+    evict_chunks()
+
+# --- HELPER: UPSTREAM SCHEDULER ---
+# Every Telegram call waits here for its turn. Classes are served strictly in PRIORITIES order under a
+# token bucket (upstream_rps, one token per request) and a cap on calls in flight. Background classes get
+# at most half of the cap, so playback always finds a free slot. Both limits scale with the session pool.
+# A FloodWait pauses only the class that hit it; downloads pause the session instead (see fetch_chunk).
+# Waits longer than flood_wait_max are never slept through: the call fails with the FloodWait.
+# Sidebar thumbnails only run while no video chunk is queued or in flight, thumb_concurrency at a time.
+PRIORITIES = ("playback", "seek", "prefetch", "indexing", "thumbs")
+BACKGROUND = ("prefetch", "indexing", "thumbs")
+VIDEO = ("playback", "seek", "prefetch")
+scheduler = {
+    "queues": {kind: deque() for kind in PRIORITIES}, "running": dict.fromkeys(PRIORITIES, 0),
+    "paused_until": dict.fromkeys(PRIORITIES, 0.0), "tokens": 0.0, "refilled": 0.0, "timer": None,
+}
+SCHED_STATS = {kind: {"granted": 0, "wait_seconds": 0.0, "flood_waits": 0} for kind in PRIORITIES}
+
+# A ticket is one logical call; it can be re-queued (retries) and moved up a class while it waits
+def new_ticket(kind, cost=1):
+    return {"kind": kind, "cost": cost, "future": None, "queued_at": 0.0, "granted": None}
+
+def dispatch():
+    now = time.monotonic()
+    sessions = max(len(session_pool), 1)
+    rate, limit = CONFIG["upstream_rps"] * sessions, CONFIG["upstream_concurrency"] * sessions
+    if rate: scheduler["tokens"] = min(rate, scheduler["tokens"] + (now - scheduler["refilled"]) * rate)
+    scheduler["refilled"] = now
+    running = scheduler["running"]
+    retry_at = None
+    granted = True
+    while granted:
+        granted = False
+        for kind in PRIORITIES:
+            queue = scheduler["queues"][kind]
+            while queue and queue[0]["future"].done(): queue.popleft()
+            if not queue: continue
+            if scheduler["paused_until"][kind] > now:
+                retry_at = min(retry_at or scheduler["paused_until"][kind], scheduler["paused_until"][kind])
+                continue
+            if sum(running.values()) >= limit: break
+            if kind in BACKGROUND and sum(running[k] for k in BACKGROUND) >= max(limit // 2, 1): continue
+            if kind == "thumbs" and (running[kind] >= CONFIG["thumb_concurrency"] or any(running[k] or scheduler["queues"][k] for k in VIDEO)): continue
+            ticket = queue[0]
+            cost = min(ticket["cost"], rate) if rate else 0
+            if scheduler["tokens"] < cost:
+                wake = now + (cost - scheduler["tokens"]) / rate
+                retry_at = min(retry_at or wake, wake)
+                break
+            queue.popleft()
+            scheduler["tokens"] -= cost
+            running[kind] += 1
+            ticket["granted"] = kind
+            SCHED_STATS[kind]["granted"] += 1
+            SCHED_STATS[kind]["wait_seconds"] += now - ticket["queued_at"]
+            observe("telo_upstream_wait_seconds", now - ticket["queued_at"], **{"class": kind})
+            ticket["future"].set_result(None)
+            granted = True
+            break
+
+    if scheduler["timer"]: scheduler["timer"].cancel()
+    scheduler["timer"] = asyncio.get_running_loop().call_later(retry_at - now, dispatch) if retry_at else None
+
+async def acquire(ticket):
+    ticket["future"] = asyncio.get_running_loop().create_future()
+    ticket["queued_at"] = time.monotonic()
+    scheduler["queues"][ticket["kind"]].append(ticket)
+    dispatch()
+    try:
+        await ticket["future"]
+    except asyncio.CancelledError:
+        if not ticket["future"].cancelled(): release(ticket)
+        raise
+
+def release(ticket):
+    scheduler["running"][ticket["granted"]] -= 1
+    dispatch()
+
+# A waiting ticket joins a more urgent class, e.g. when playback needs a chunk prefetch already queued
+def bump_ticket(ticket, kind):
+    if PRIORITIES.index(kind) >= PRIORITIES.index(ticket["kind"]): return
+    old_queue = scheduler["queues"][ticket["kind"]]
+    ticket["kind"] = kind
+    if ticket["future"] and not ticket["future"].done() and ticket in old_queue:
+        old_queue.remove(ticket)
+        scheduler["queues"][kind].append(ticket)
+        dispatch()
+
+def pause_class(kind, seconds):
+    scheduler["paused_until"][kind] = max(scheduler["paused_until"][kind], time.monotonic() + seconds)
+    SCHED_STATS[kind]["flood_waits"] += 1
+    log(f"⏸️ {kind} calls paused for {seconds}s (FloodWait)")
+
+# Runs call() once its class gets a slot. Short FloodWaits are waited out with only this class paused.
+async def upstream(kind, call, cost=1, ticket=None):
+    ticket = ticket or new_ticket(kind)
+    ticket["cost"] = cost
+    while True:
+        await acquire(ticket)
+        called = time.monotonic()
+        try:
+            return await call()
+        except errors.FloodWaitError as e:
+            pause_class(ticket["granted"], e.seconds)
+            if e.seconds > CONFIG["flood_wait_max"]: raise
+        finally:
+            observe("telo_upstream_call_seconds", time.monotonic() - called, **{"class": ticket["granted"]})
+            release(ticket)
+
+# --- HELPER: SESSION POOL ---
+# Downloads are spread over the main session plus any extra accounts added with `telo login add`
+# (indexing stays on the main one). Each session has its own DC connections. A session that hits
+# FloodWait, or an extra account that cannot read a file, is benched and its parts go to the others.
+# A FloodWait hit by a background download benches the session for background downloads only.
+def pool_entry(pool_client, label):
+    return {
+        "client": pool_client, "label": label, "senders": {}, "auth_keys": {},
+        "busy": 0, "benched_until": 0.0, "background_until": 0.0, "fetched": 0, "flood_waits": 0, "errors": 0,
+    }
+
+def read_extra_sessions():
+    try:
+        with open(SESSIONS_FILE) as f: return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+async def start_session_pool():
+    session_pool[:] = [pool_entry(client, "main")]
+    for extra in read_extra_sessions():
+        extra_client = TelegramClient(StringSession(extra["session"]), int(extra["api_id"]), extra["api_hash"], flood_sleep_threshold=0)
+        try:
+            await extra_client.connect()
+            if not await extra_client.is_user_authorized(): raise Exception("not authorized")
+        except Exception as e:
+            log(f"⚠️ Session {extra.get('phone')} skipped: {e}")
+            try: await extra_client.disconnect()
+            except Exception: pass
+            continue
+        session_pool.append(pool_entry(extra_client, extra.get("phone") or f"session {len(session_pool)}"))
+    if len(session_pool) > 1: log(f"👥 {len(session_pool)} download sessions")
+
+async def close_session_pool():
+    for session in session_pool:
+        for senders in session["senders"].values():
+            for sender in senders:
+                try: await sender.disconnect()
+                except Exception: pass
+        session["senders"].clear()
+        if session["client"] is not client: await session["client"].disconnect()
+    session_pool.clear()
+
+def session_ready_at(session, kind):
+    return max(session["benched_until"], session["background_until"] if kind in BACKGROUND else 0.0)
+
+# Raised when no session can download for kind within flood_wait_max, so streams end instead of stalling
+def check_sessions(kind):
+    wait = min((session_ready_at(session, kind) for session in session_pool), default=0.0) - time.monotonic()
+    if wait > CONFIG["flood_wait_max"]: raise errors.FloodWaitError(request=None, capture=int(wait) + 1)
+
+# Least busy session that is not benched; when every one is benched, waits for the first to return
+async def pick_session(ticket):
+    while True:
+        now, kind = time.monotonic(), ticket["kind"]
+        ready = [session for session in session_pool if session_ready_at(session, kind) <= now]
+        if ready: return min(ready, key=lambda session: session["busy"])
+        check_sessions(kind)
+        await asyncio.sleep(min(session_ready_at(session, kind) for session in session_pool) - now)
+
+def bench_session(session, seconds, reason, background=False):
+    field = "background_until" if background else "benched_until"
+    session[field] = max(session[field], time.monotonic() + seconds)
+    log(f"⏸️ Session {session['label']} paused{' for background downloads' if background else ''} for {seconds}s ({reason})")
+
+# --- HELPER: PARALLEL DOWNLOADER ---
+# Extra MTProto connections to a file's DC, built the same way Telethon builds its exported senders.
+# The home DC reuses the session's auth key; other DCs import an exported authorization once and share its key.
+async def open_dc_sender(session, dc_id):
+    owner = session["client"]
+    dc = await owner._get_dc(dc_id)
+    auth_key = owner.session.auth_key if dc_id == owner.session.dc_id else session["auth_keys"].get(dc_id)
+    sender = MTProtoSender(auth_key, loggers=owner._log)
+    await sender.connect(owner._connection(
+        dc.ip_address, dc.port, dc.id,
+        loggers=owner._log, proxy=owner._proxy, local_addr=owner._local_addr
+    ))
+    if not auth_key:
+        auth = await owner(functions.auth.ExportAuthorizationRequest(dc_id))
+        owner._init_request.query = functions.auth.ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+        await sender.send(functions.InvokeWithLayerRequest(LAYER, owner._init_request))
+        session["auth_keys"][dc_id] = sender.auth_key
+    return sender
+
+async def get_dc_senders(session, dc_id):
+    dc_senders = session["senders"]
+    if dc_id not in dc_senders:
+        dc_senders[dc_id] = []
+        try:
+            for _ in range(CONFIG["download_connections"]):
+                dc_senders[dc_id].append(await open_dc_sender(session, dc_id))
+            log(f"⚡ {len(dc_senders[dc_id])} download connections to DC {dc_id} ({session['label']})")
+        except Exception as e:
+            log(f"⚠️ Extra connections to DC {dc_id} unavailable for {session['label']}, using its main one: {e}")
+    return dc_senders[dc_id]
+
+# One CHUNK_SIZE block at index idx, fetched by the least busy healthy session once the scheduler
+# grants the ticket (one token per part). FloodWait is raised straight away instead of slept through,
+# so the chunk can move to another session at once.
+async def fetch_chunk(media, idx, ticket=None):
+    ticket = ticket or new_ticket("playback")
+    ticket["cost"] = len(range(idx * CHUNK_SIZE, min((idx + 1) * CHUNK_SIZE, media["size"]), PART_SIZE)) or 1
+    while True:
+        session = await pick_session(ticket)
+        await acquire(ticket)
+        session["busy"] += 1
+        called = time.monotonic()
+        try:
+            data = await fetch_chunk_with(session, media, idx)
+            session["fetched"] += len(data)
+            observe("telo_chunk_download_seconds", time.monotonic() - called, **{"class": ticket["granted"]})
+            return data
+        except errors.FloodWaitError as e:
+            session["flood_waits"] += 1
+            bench_session(session, e.seconds, "FloodWait", background=ticket["granted"] in BACKGROUND)
+        except (errors.FileReferenceExpiredError, errors.FilerefUpgradeNeededError):
+            raise
+        except errors.RPCError as e:
+            if session["client"] is client: raise
+            session["errors"] += 1
+            bench_session(session, 300, type(e).__name__)
+        finally:
+            session["busy"] -= 1
+            release(ticket)
+
+# Its PART_SIZE requests run at once on one of the session's DC senders.
+# Parts that arrive for a fetch that then gets cancelled are counted as wasted.
+async def fetch_chunk_with(session, media, idx):
+    owner = session["client"]
+    senders = await get_dc_senders(session, media["dc_id"])
+    if not senders:
+        async for data in owner.iter_download(media["location"], offset=idx * CHUNK_SIZE, request_size=PART_SIZE,
+                                              chunk_size=CHUNK_SIZE, limit=1, file_size=media["size"], dc_id=media["dc_id"]):
+            STREAM_STATS["bytes_fetched"] += len(data)
+            return bytes(data)
+        return b""
+
+    sender = senders[idx % len(senders)]
+    received = []
+    async def fetch_part(offset):
+        request = functions.upload.GetFileRequest(media["location"], offset=offset, limit=PART_SIZE)
+        called = time.monotonic()
+        part = await owner._call(sender, request, flood_sleep_threshold=0)
+        observe("telo_part_rpc_seconds", time.monotonic() - called)
+        received.append(len(part.bytes))
+        STREAM_STATS["bytes_fetched"] += len(part.bytes)
+        return part.bytes
+
+    offsets = range(idx * CHUNK_SIZE, min((idx + 1) * CHUNK_SIZE, media["size"]), PART_SIZE)
+    try:
+        return b"".join(await asyncio.gather(*(fetch_part(offset) for offset in offsets)))
+    except asyncio.CancelledError:
+        STREAM_STATS["bytes_wasted"] += sum(received)
+        raise
+
+# --- BACKGROUND INDEXING ---
+def publish_index(course, index, fresh):
+    load_lesson_media(course, fresh)
+    publish_structure(course, build_structure(index["records"]))
+
+# Runs in the background once a course is loaded: lessons are published as they are found.
+# The saved index is published before Telegram is contacted, so mirrored courses also work offline.
+async def index_course(course):
+    started = time.monotonic()
+    try:
+        index = course["index"] = load_course_index(course["key"], course["link"])
+        saved_max_id = index["max_id"]
+        if index["max_id"]:
+            log(f"📂 Loaded saved index ({len(index['records'])} entries), checking for new posts...")
+            publish_index(course, index, index["records"])
+
+        entity, latest = await resolve_target(course)
+        course["entity"] = entity
+        log(f"✅ Connected to: {course['channel_title'] or 'Unknown Course'}")
+
+        set_index_status(course, state="indexing")
+        known = len(index["records"])
+        try:
+            await sync_course_index(entity, index, lambda fresh: publish_index(course, index, fresh), latest)
+        except Exception as e:
+            log(f"⚠️ Sync stopped early, serving what was indexed: {e}")
+        added = len(index["records"]) - known
+        # Posts changed while the scan ran are applied now, in arrival order (no await from here to the end)
+        held, course["live"] = course["live"], []
+        for messages, deleted_ids in held: apply_live_update(course, messages, deleted_ids)
+        # Saved whenever max_id moved, even past posts that are not lessons, so they are not scanned again
+        if added or held or index["max_id"] != saved_max_id or not os.path.exists(index_path(course["key"])):
+            save_course_index(course["key"], index)
+
+        course["status"]["state"] = "ready"
+        publish_index(course, index, [])
+        course["indexing"] = {"seconds": round(time.monotonic() - started, 3), "scanned_ids": index["max_id"] - saved_max_id, "added": added}
+        INDEX_STATS["runs"] += 1
+        observe("telo_index_seconds", time.monotonic() - started)
+        trace("index", course=course["key"], **course["indexing"])
+        log(f"📚 Indexed {len(course['structure'])} Sections ({added} new entries).")
+
+    except Exception as e:
+        set_index_status(course, state="error", error=str(e))
+        log(f"❌ Error: {e}")
+
+# --- LIVE UPDATES (TELEGRAM EVENTS) ---
+# New, edited and deleted posts in the channel of a loaded course change its index right away, using the same
+# rules as a scan (message_record). While a course is still indexing, events are held and applied once the scan
+# has merged (index_course). Courses that are not loaded pick up new posts on their next load.
+def live_courses(chat_id):
+    if chat_id is None: return []
+    channel_id, _ = utils.resolve_id(chat_id)
+    return [course for course in courses.values() if course["channel_id"] == channel_id and course["index"] is not None]
+
+# Returns True when the index changed. A lesson whose video was replaced loses its cached media and chunks.
+def apply_live_update(course, messages, deleted_ids):
+    records = course["index"]["records"]
+    changed = False
+    updates = [(msg.id, message_record(msg)) for msg in messages] + [(msg_id, None) for msg_id in deleted_ids]
+    for msg_id, rec in updates:
+        pos = bisect.bisect_left(records, msg_id, key=lambda r: r["id"])
+        old = records[pos] if pos < len(records) and records[pos]["id"] == msg_id else None
+        if old: forget_lesson(course, old, rec)
+        if rec and old: records[pos] = rec
+        elif rec: records.insert(pos, rec)
+        elif old: records.pop(pos)
+        if rec and "doc" in rec: load_lesson_media(course, [rec])
+        changed = changed or bool(rec or old)
+    return changed
+
+def forget_lesson(course, old, rec):
+    if "doc" not in old: return
+    if rec and rec.get("doc", [None])[0] == old["doc"][0]:
+        if "boxes" in old: rec["boxes"] = old["boxes"]
+        return
+    course["media"].pop(old["id"], None)
+    drop_lesson_chunks(old["doc"][0])
+
+async def on_live_event(event):
+    if isinstance(event, events.MessageDeleted.Event): messages, deleted_ids = [], event.deleted_ids
+    else: messages, deleted_ids = [event.message], []
+    for course in live_courses(event.chat_id):
+        if course["indexer"] and not course["indexer"].done():
+            course["live"].append((messages, deleted_ids))
+            continue
+        if not apply_live_update(course, messages, deleted_ids): continue
+        save_course_index(course["key"], course["index"])
+        publish_structure(course, build_structure(course["index"]["records"]))
+        log(f"🔔 {course['title']}: {'removed' if deleted_ids else 'updated'} post {(deleted_ids or [messages[0].id])[0]}")
+
+# --- COURSES (LOADED ON DEMAND) ---
+# Any course in courses.json is served under /c/<short id>/. Its index is loaded on first use and
+# it is unloaded after idle_course_minutes without viewers, or when more than max_loaded_courses are loaded.
+# All courses share the one client, its download connections and the chunk cache.
+def new_course(course_key, info):
+    return {
+        "key": course_key, "title": info.get("title") or course_key, "link": info["channel_link"],
+        "entity": None, "channel_id": 0, "channel_title": None,
+        "index": None, "structure": {}, "version": 0, "status": {"state": "starting"}, "changed": asyncio.Event(),
+        "media": {}, "refreshes": {}, "locating": {}, "page": {"key": None}, "listing": {"version": None},
+        "indexer": None, "indexing": None, "live": [], "listeners": 0, "last_used": time.monotonic(),
+    }
+
+def get_course(course_key):
+    course = courses.get(course_key)
+    if not course:
+        info = read_course(course_key)
+        if not info or not info.get("channel_link"): return None
+        course = courses[course_key] = new_course(course_key, info)
+        course["indexer"] = asyncio.create_task(index_course(course))
+        log(f"📖 Loaded course: {course['title']}")
+        evict_courses(keep=course)
+    course["last_used"] = time.monotonic()
+    return course
+
+def course_busy(course):
+    return course["listeners"] > 0 or any(key[1] == course["key"] for key in active_streams)
+
+def evict_courses(keep=None):
+    now = time.monotonic()
+    excess = len(courses) - CONFIG["max_loaded_courses"]
+    for course in sorted(courses.values(), key=lambda c: c["last_used"]):
+        if course is keep or course_busy(course): continue
+        if excess > 0 or now - course["last_used"] > CONFIG["idle_course_minutes"] * 60:
+            excess -= 1
+            courses.pop(course["key"], None)
+            asyncio.create_task(unload_course(course))
+
+async def unload_course(course):
+    courses.pop(course["key"], None)
+    task = course["indexer"]
+    if task and not task.done():
+        task.cancel()
+        try: await task
+        except asyncio.CancelledError: pass
+    for viewer, state in list(prefetchers.items()):
+        if state["key"][0] == course["key"]: stop_prefetch(viewer)
+    for task in list(course["locating"].values()): task.cancel()
+    # A scan cut short is still consistent (max_id only covers merged shards), so keep its progress
+    index = course["index"]
+    if index is not None and (index.pop("dirty", False) or course["status"]["state"] != "ready"):
+        save_course_index(course["key"], index)
+    log(f"💤 Unloaded course: {course['title']}")
+
+async def evict_idle_courses():
+    while True:
+        await asyncio.sleep(60)
+        evict_courses()
+
 # --- LIFESPAN MANAGER ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global target_entity, course_structure
+    global janitor, progress_writer
     log("🚀 Server Starting...")
     if not client: sys.exit(1)
 
-    await client.start()
     try:
-        identifier = await resolve_channel(CHANNEL_INPUT)
-        try:
-            target_entity = await client.get_entity(identifier)
-        except ValueError:
-            async for dialog in client.iter_dialogs():
-                if dialog.id == identifier or str(dialog.id).endswith(str(identifier).replace("-100", "")):
-                    target_entity = dialog.entity
-                    break
-            if not target_entity: raise Exception("Channel not found!")
-
-        channel_title = getattr(target_entity, 'title', 'Unknown Course')
-        log(f"✅ Connected to: {channel_title}")
-        
-        all_msgs = []
-        async for msg in client.iter_messages(target_entity, limit=None):
-            if msg.media or (msg.message and "MODULE:" in msg.message.upper()):
-                all_msgs.append(msg)
-        all_msgs.reverse()
-
-        current_module = "Course Content"
-        course_structure = {current_module: []}
-        
-        for msg in all_msgs:
-            if msg.message and not msg.media:
-                text = msg.message.strip()
-                if "MODULE:" in text.upper() or (len(text) < 60 and not text.startswith("http")):
-                    clean_name = text.replace("MODULE:", "").replace("Module:", "").strip()
-                    clean_name = re.sub(r'^[-_|\s]+', '', clean_name)
-                    current_module = clean_name
-                    if current_module not in course_structure: 
-                        course_structure[current_module] = []
-            
-            elif msg.media and hasattr(msg, 'file'):
-                is_video = False
-                if hasattr(msg.file, 'mime_type') and msg.file.mime_type.startswith('video/'):
-                    is_video = True
-                
-                if is_video:
-                    raw_name = getattr(msg.file, 'name', None)
-                    if not raw_name: raw_name = f"Lesson {msg.id}"
-                    final_title = clean_title(raw_name)
-                    course_structure[current_module].append({ "id": msg.id, "title": final_title })
-
-        course_structure = {k: v for k, v in course_structure.items() if v}
-        log(f"📚 Indexed {len(course_structure)} Sections.")
-        
-        # Trigger Browser AFTER Indexing is done
-        threading.Thread(target=trigger_browser).start()
-        
-    except Exception as e:
-        log(f"❌ Error: {e}")
-    
+        await client.start()
+    except OSError as e:
+        log(f"📴 Telegram unreachable, serving saved indexes and mirrored lessons only: {e}")
+    init_chunk_cache()
+    for event_type in (events.NewMessage, events.MessageEdited, events.MessageDeleted):
+        client.add_event_handler(on_live_event, event_type())
+    await start_session_pool()
+    janitor = asyncio.create_task(evict_idle_courses())
+    progress_writer = asyncio.create_task(write_progress())
+
     yield
+    janitor.cancel()
+    progress_writer.cancel()
+    flush_progress()
+    for course in list(courses.values()): await unload_course(course)
+    await close_session_pool()
     if client: await client.disconnect()
 
 app = FastAPI(lifespan=lifespan)
@@ -217,52 +1174,13 @@ async def serve_logo_file():
     path = os.path.join(BASE_DIR, "logo.png")
     return FileResponse(path) if os.path.exists(path) else Response(status_code=404)
 
-@app.get("/")
-async def dashboard():
-    sidebar_html = ""
-    icon_circle = '<svg viewBox="0 0 24 24" class="icon icon-status"><path fill="currentColor" d="M12 2C6.48 2 2 6.48 2 12s4.48 10 10 10 10-4.48 10-10S17.52 2 12 2zm0 18c-4.41 0-8-3.59-8-8s3.59-8 8-8 8 3.59 8 8-3.59 8-8 8z"></path></svg>'
+# The sidebar itself is rendered in the browser from api/structure (virtualized), so the page stays small.
+# The page lives at /c/<short id>/ and uses relative URLs for its course API and streams.
+def render_dashboard(course):
+    course_structure = course["structure"]
     is_flat_course = (len(course_structure) == 1 and "Course Content" in course_structure)
 
-    if is_flat_course:
-        videos = course_structure["Course Content"]
-        for vid in videos:
-            sidebar_html += f'''
-            <div class="lesson-item" id="lesson-{vid['id']}" data-id="{vid['id']}" onclick="loadVideo({vid['id']}, '{vid['title']}', this)">
-                <div class="status-icon-wrapper" onclick="toggleCompletion(event, {vid['id']})">
-                    {icon_circle}
-                </div>
-                <div class="lesson-content">
-                    <span class="lesson-title">{vid['title']}</span>
-                </div>
-                <div class="progress-track"><div class="progress-fill" id="progress-{vid['id']}"></div></div>
-            </div>'''
-    else:
-        for i, (module_name, videos) in enumerate(course_structure.items()):
-            is_first = (i == 0)
-            display_style = "block" if is_first else "none"
-            header_class = "section-header" if is_first else "section-header collapsed"
-            sidebar_html += f'''
-            <div class="section-container" data-module-index="{i}">
-                <div class="{header_class}" onclick="toggleSection(this)">
-                    <div class="header-left"><span class="section-title">{module_name}</span></div>
-                    <span class="arrow">▼</span>
-                </div>
-                <div class="section-videos" style="display: {display_style};">
-            '''
-            for vid in videos:
-                sidebar_html += f'''
-                <div class="lesson-item" id="lesson-{vid['id']}" data-id="{vid['id']}" onclick="loadVideo({vid['id']}, '{vid['title']}', this)">
-                    <div class="status-icon-wrapper" onclick="toggleCompletion(event, {vid['id']})">
-                        {icon_circle}
-                    </div>
-                    <div class="lesson-content">
-                        <span class="lesson-title">{vid['title']}</span>
-                    </div>
-                    <div class="progress-track"><div class="progress-fill" id="progress-{vid['id']}"></div></div>
-                </div>'''
-            sidebar_html += "</div></div>"
-
-    page_title = getattr(target_entity, 'title', 'TELO Player')
+    page_title = course["channel_title"] or 'TELO Player'
     
     html_content = f"""
     <!DOCTYPE html>
@@ -324,8 +1242,11 @@ async def dashboard():
                 border-top: var(--border); background: var(--bg-sidebar); 
             }}
             
+            #rows {{ position: relative; }}
+            #rows .v-row {{ position: absolute; left: 0; right: 0; }}
+
             .section-header {{ 
-                padding: 16px 20px; cursor: pointer; display: flex; 
+                padding: 16px 20px; cursor: pointer; display: flex; height: 50px;
                 justify-content: space-between; align-items: center; 
                 background: var(--bg-sidebar); border-bottom: 1px solid #1a1a1a;
             }}
@@ -347,6 +1268,11 @@ async def dashboard():
             .lesson-item.active {{ background: var(--bg-active); }}
             .lesson-item.active .lesson-title {{ color: var(--accent); font-weight: 500; }}
             
+            .lesson-thumb {{
+                width: 46px; height: 26px; flex-shrink: 0; border-radius: 3px;
+                object-fit: cover; background: #1a1a1a;
+            }}
+
             .lesson-content {{
                 flex: 1; min-width: 0; display: flex; align-items: center;
             }}
@@ -424,12 +1350,12 @@ async def dashboard():
                 <span class="brand-text">TELO</span>
                 <span class="brand-course">{page_title}</span>
             </a>
-            <div style="font-size: 0.8rem; color: #666;">{len(course_structure) if not is_flat_course else len(course_structure["Course Content"])} {("Modules" if not is_flat_course else "Videos")}</div>
+            <div id="course-count" style="font-size: 0.8rem; color: #666;">{len(course_structure) if not is_flat_course else len(course_structure["Course Content"])} {("Modules" if not is_flat_course else "Videos")}</div>
         </nav>
 
         <div class="app-container">
             <div id="sidebar">
-                <div id="curriculum">{sidebar_html}</div>
+                <div id="curriculum"><div id="rows"></div></div>
                 <div class="footer">
                     Made with <span style="color:#e91e63;">&#10084;</span> by <b>Thnoxs</b>
                 </div>
@@ -459,88 +1385,254 @@ async def dashboard():
             var player = videojs('vid', {{ fluid: false, fill: true, playbackRates: [0.75, 1, 1.25, 1.5, 2] }});
             var currentId = null;
 
+            // --- Virtualized sidebar: only rows in view get DOM nodes, lesson titles load page by page ---
+            const ROW_H = 50, PAGE = 200, OVERSCAN = 8;
+            const curriculum = document.getElementById('curriculum');
+            const rowsEl = document.getElementById('rows');
+            let course = null;           // {{ modules, lesson_ids, flat, total }}
+            let lessons = [];            // lesson index -> {{ id, title }} (filled page by page)
+            let lessonIndex = {{}};      // lesson id -> lesson index
+            let progress = {{}};         // lesson id -> percent watched
+            let positions = {{}};        // lesson id -> [seconds, duration] last reported
+            let expanded = new Set([0]);
+            let rows = [];
+            const pagesLoading = {{}};
+            const thumbsShown = new Set();   // thumbnail URLs already requested (the browser caches them)
+            const noThumb = new Set();       // lesson ids whose thumbnail failed to load
+            let scrolling = false, scrollIdle = null;
+
+            function esc(text) {{ const d = document.createElement('div'); d.textContent = text; return d.innerHTML; }}
+
+            function storePage(page) {{ page.lessons.forEach((l, i) => lessons[page.offset + i] = l); }}
+
+            function loadPage(index) {{
+                const offset = Math.floor(index / PAGE) * PAGE;
+                if (!pagesLoading[offset]) {{
+                    pagesLoading[offset] = fetch('api/structure?offset=' + offset + '&limit=' + PAGE)
+                        .then(r => r.json()).then(page => {{ if (page.version === course.version) {{ storePage(page); renderRows(); }} }});
+                }}
+                return pagesLoading[offset];
+            }}
+
+            function moduleOf(index) {{
+                return course.modules.findIndex(m => index >= m.start && index < m.start + m.count);
+            }}
+
+            function buildRows() {{
+                rows = [];
+                if (course.flat) {{
+                    for (let i = 0; i < course.total; i++) rows.push({{ lesson: i }});
+                }} else {{
+                    course.modules.forEach((m, mi) => {{
+                        rows.push({{ module: mi }});
+                        if (expanded.has(mi)) for (let i = m.start; i < m.start + m.count; i++) rows.push({{ lesson: i }});
+                    }});
+                }}
+                rowsEl.style.height = (rows.length * ROW_H) + 'px';
+                renderRows();
+            }}
+
+            function statusIcon(id) {{
+                if ((progress[id] || 0) >= 100) return ICON_CHECK;
+                return id === currentId ? WAVE_HTML : ICON_CIRCLE;
+            }}
+
+            // New thumbnails are requested only for rows on screen once scrolling settles; overscan rows get a placeholder
+            function thumbHtml(lesson, visible) {{
+                if (!lesson.thumb || noThumb.has(lesson.id)) return '';
+                const src = 'thumb/' + lesson.id + '?v=' + lesson.thumb;
+                if (!thumbsShown.has(src) && !(visible && !scrolling)) return '<span class="lesson-thumb"></span>';
+                thumbsShown.add(src);
+                return `<img class="lesson-thumb" src="${{src}}" alt="" onerror="noThumb.add(${{lesson.id}}); this.style.visibility='hidden'">`;
+            }}
+
+            function renderRows() {{
+                if (!course) return;
+                const shownFirst = Math.floor(curriculum.scrollTop / ROW_H);
+                const shownLast = Math.ceil((curriculum.scrollTop + curriculum.clientHeight) / ROW_H);
+                const first = Math.max(0, shownFirst - OVERSCAN);
+                const last = Math.min(rows.length, shownLast + OVERSCAN);
+                let html = '';
+                for (let r = first; r < last; r++) {{
+                    const row = rows[r], top = r * ROW_H;
+                    if (row.module !== undefined) {{
+                        const collapsed = expanded.has(row.module) ? '' : ' collapsed';
+                        html += `<div class="v-row section-header${{collapsed}}" style="top:${{top}}px" onclick="toggleSection(${{row.module}})">
+                            <div class="header-left"><span class="section-title">${{esc(course.modules[row.module].name)}}</span></div>
+                            <span class="arrow">▼</span></div>`;
+                        continue;
+                    }}
+                    const lesson = lessons[row.lesson];
+                    if (!lesson) {{
+                        loadPage(row.lesson);
+                        html += `<div class="v-row lesson-item" style="top:${{top}}px"><div class="lesson-content"><span class="lesson-title">…</span></div></div>`;
+                        continue;
+                    }}
+                    const active = lesson.id === currentId ? ' active' : '';
+                    html += `<div class="v-row lesson-item${{active}}" id="lesson-${{lesson.id}}" data-id="${{lesson.id}}" style="top:${{top}}px" onclick="loadVideo(${{lesson.id}})">
+                        <div class="status-icon-wrapper" onclick="toggleCompletion(event, ${{lesson.id}})">${{statusIcon(lesson.id)}}</div>
+                        ${{thumbHtml(lesson, r >= shownFirst && r < shownLast)}}
+                        <div class="lesson-content"><span class="lesson-title">${{esc(lesson.title)}}</span></div>
+                        <div class="progress-track"><div class="progress-fill" id="progress-${{lesson.id}}" style="width:${{progress[lesson.id] || 0}}%"></div></div>
+                    </div>`;
+                }}
+                rowsEl.innerHTML = html;
+            }}
+
+            let scrollQueued = false;
+            curriculum.addEventListener('scroll', () => {{
+                scrolling = true;
+                clearTimeout(scrollIdle);
+                scrollIdle = setTimeout(() => {{ scrolling = false; renderRows(); }}, 150);
+                if (scrollQueued) return;
+                scrollQueued = true;
+                requestAnimationFrame(() => {{ scrollQueued = false; renderRows(); }});
+            }});
+            window.addEventListener('resize', renderRows);
+
+            function scrollToLesson(index) {{
+                const r = rows.findIndex(row => row.lesson === index);
+                if (r < 0) return;
+                const top = r * ROW_H;
+                if (top < curriculum.scrollTop || top + ROW_H > curriculum.scrollTop + curriculum.clientHeight) {{
+                    curriculum.scrollTop = top - curriculum.clientHeight / 2;
+                }}
+            }}
+
             player.on('timeupdate', () => {{
-                if(!currentId) return;
+                if(!currentId || !player.duration()) return;
                 const percent = (player.currentTime() / player.duration()) * 100;
+                if ((progress[currentId] || 0) < 100) progress[currentId] = percent;
+                positions[currentId] = [player.currentTime(), player.duration()];
+                queueProgress(currentId, 10000);
                 const progressBar = document.getElementById('progress-' + currentId);
-                if(progressBar) progressBar.style.width = percent + '%';
+                if(progressBar) progressBar.style.width = progress[currentId] + '%';
             }});
 
-            window.onload = function() {{ 
-                const first = document.querySelector('.lesson-item'); 
-                if(first) first.click(); 
+            // --- Watch progress: saved on the server in batches, never once per timeupdate ---
+            const unsent = {{}};
+            let progressTimer = null, progressDue = 0;
+
+            function queueProgress(id, delay) {{
+                const [position, duration] = positions[id] || [0, 0];
+                unsent[id] = {{ position, duration, done: (progress[id] || 0) >= 100 }};
+                if (progressTimer && progressDue <= Date.now() + delay) return;
+                clearTimeout(progressTimer);
+                progressDue = Date.now() + delay;
+                progressTimer = setTimeout(sendProgress, delay);
+            }}
+
+            function sendProgress(beacon) {{
+                clearTimeout(progressTimer); progressTimer = null;
+                const ids = Object.keys(unsent);
+                if (!ids.length) return;
+                const body = JSON.stringify({{ lessons: Object.fromEntries(ids.map(id => [id, unsent[id]])) }});
+                ids.forEach(id => delete unsent[id]);
+                if (beacon === true) navigator.sendBeacon('api/progress', new Blob([body], {{ type: 'application/json' }}));
+                else fetch('api/progress', {{ method: 'POST', headers: {{ 'Content-Type': 'application/json' }}, body }});
+            }}
+
+            async function loadProgress() {{
+                const saved = (await fetch('api/progress').then(r => r.json())).lessons;
+                for (const id in saved) {{
+                    const entry = saved[id];
+                    positions[id] = [entry.position, entry.duration];
+                    progress[id] = entry.done ? 100 : (entry.duration ? entry.position / entry.duration * 100 : 0);
+                }}
+            }}
+
+            player.on('pause', () => {{ if (currentId) queueProgress(currentId, 1000); }});
+            window.addEventListener('pagehide', () => sendProgress(true));
+            document.addEventListener('visibilitychange', () => {{ if (document.visibilityState === 'hidden') sendProgress(true); }});
+
+            // Indexing runs in the background: every new structure version re-reads the first page
+            async function refreshCourse() {{
+                const first = await fetch('api/structure?offset=0&limit=' + PAGE).then(r => r.json());
+                course = first;
+                lessons = []; lessonIndex = {{}};
+                for (const key in pagesLoading) delete pagesLoading[key];
+                course.lesson_ids.forEach((id, i) => lessonIndex[id] = i);
+                storePage(first);
+                showStatus(first.status);
+                buildRows();
+                if (!currentId && course.lesson_ids.length) loadVideo(lessonFromHash() || course.lesson_ids[0]);
+            }}
+
+            // `telo play <lesson words>` opens the page at #lesson-<id>; the hash follows the current lesson
+            function lessonFromHash() {{
+                const match = location.hash.match(/^#lesson-(\d+)$/);
+                return match && lessonIndex[+match[1]] !== undefined ? +match[1] : null;
+            }}
+            window.addEventListener('hashchange', () => {{ const id = lessonFromHash(); if (id && id !== currentId) loadVideo(id); }});
+
+            function showStatus(status) {{
+                const count = course.flat ? course.total + ' Videos' : course.modules.length + ' Modules';
+                const state = status.state === 'ready' ? '' : (status.state === 'error' ? ' · index error' : ' · indexing…');
+                document.getElementById('course-count').innerText = count + state;
+                if (!currentId && status.state !== 'ready') document.getElementById('video-header').innerText = 'Indexing course…';
+            }}
+
+            window.onload = async function() {{ 
+                await loadProgress();
+                await refreshCourse();
+                const events = new EventSource('api/events');
+                events.onmessage = (e) => {{
+                    const update = JSON.parse(e.data);
+                    if (update.version !== course.version) refreshCourse(); else showStatus(update.status);
+                }};
             }};
 
-            function loadVideo(id, title, element) {{
+            async function loadVideo(id) {{
                 if(currentId === id) {{ player.paused() ? player.play() : player.pause(); return; }}
+                const index = lessonIndex[id];
+                if (index === undefined) return;
+                if (!lessons[index]) await loadPage(index);
                 currentId = id; 
+                history.replaceState(null, '', '#lesson-' + id);
 
-                document.querySelectorAll('.lesson-item').forEach(el => {{ 
-                    el.classList.remove('active');
-                    const prog = el.querySelector('.progress-fill');
-                    const iconWrap = el.querySelector('.status-icon-wrapper');
-                    if(prog.style.width !== '100%') iconWrap.innerHTML = ICON_CIRCLE;
-                    else iconWrap.innerHTML = ICON_CHECK;
-                }});
-                
-                element.classList.add('active'); 
-                const iconWrap = element.querySelector('.status-icon-wrapper');
-                if(element.querySelector('.progress-fill').style.width !== '100%') iconWrap.innerHTML = WAVE_HTML;
-
-                document.getElementById('video-header').innerText = title;
-
-                const parentSection = element.closest('.section-videos');
-                if (parentSection) {{
-                    document.querySelectorAll('.section-videos').forEach(sec => {{
-                        if (sec !== parentSection) {{ sec.style.display = 'none'; sec.previousElementSibling.classList.add('collapsed'); }}
-                    }});
-                    parentSection.style.display = 'block'; parentSection.previousElementSibling.classList.remove('collapsed'); 
+                document.getElementById('video-header').innerText = lessons[index].title;
+
+                if (!course.flat) {{
+                    const mi = moduleOf(index);
+                    if (!expanded.has(mi) || expanded.size > 1) {{ expanded = new Set([mi]); buildRows(); }}
                 }}
+                scrollToLesson(index);
+                renderRows();
 
-                player.src({{ src: '/stream/' + id, type: 'video/mp4' }}); 
+                // Half-watched lessons pick up where they stopped (the server warms that spot on the first request)
+                const resumeAt = (progress[id] || 0) < 100 && positions[id] ? positions[id][0] : 0;
+                player.src({{ src: 'stream/' + id, type: 'video/mp4' }}); 
+                if (resumeAt >= 10) player.one('loadedmetadata', () => {{ if (currentId === id) player.currentTime(resumeAt); }});
                 player.play();
             }}
 
             function toggleCompletion(e, id) {{
                 e.stopPropagation();
-                const el = document.getElementById('lesson-' + id);
-                const iconWrap = el.querySelector('.status-icon-wrapper');
-                const progress = el.querySelector('.progress-fill');
-                
-                if (progress.style.width === '100%') {{
-                    progress.style.width = '0%';
-                    iconWrap.innerHTML = (currentId === id) ? WAVE_HTML : ICON_CIRCLE;
-                }} else {{
-                    progress.style.width = '100%';
-                    iconWrap.innerHTML = ICON_CHECK;
-                }}
+                progress[id] = (progress[id] || 0) >= 100 ? 0 : 100;
+                // Un-marked lessons start over, otherwise the saved position would read as complete again
+                if (!progress[id] && positions[id]) positions[id] = [0, positions[id][1]];
+                queueProgress(id, 1000);
+                renderRows();
             }}
 
             player.on('ended', () => {{
-                const el = document.getElementById('lesson-' + currentId);
-                if(el) {{
-                    el.querySelector('.status-icon-wrapper').innerHTML = ICON_CHECK;
-                    el.querySelector('.progress-fill').style.width = '100%';
-                }}
+                progress[currentId] = 100;
+                queueProgress(currentId, 1000);
+                renderRows();
                 playNext();
             }});
 
-            function toggleSection(header) {{ 
-                const content = header.nextElementSibling; 
-                const isCollapsed = content.style.display === 'none'; 
-                content.style.display = isCollapsed ? 'block' : 'none'; 
-                header.classList.toggle('collapsed', !isCollapsed); 
+            function toggleSection(mi) {{ 
+                if (expanded.has(mi)) expanded.delete(mi); else expanded.add(mi);
+                buildRows();
             }}
-            function getAllIds() {{ return Array.from(document.querySelectorAll('.lesson-item')).map(el => parseInt(el.getAttribute('data-id'))); }}
             function playNext() {{ 
-                const ids = getAllIds(); 
-                const next = ids[ids.indexOf(currentId) + 1]; 
-                if (next) document.getElementById('lesson-'+next).click(); 
+                const next = course.lesson_ids[lessonIndex[currentId] + 1]; 
+                if (next) loadVideo(next); 
             }}
             function playPrev() {{ 
-                const ids = getAllIds(); 
-                const prev = ids[ids.indexOf(currentId) - 1]; 
-                if (prev) document.getElementById('lesson-'+prev).click(); 
+                const prev = course.lesson_ids[lessonIndex[currentId] - 1]; 
+                if (prev) loadVideo(prev); 
             }}
             function toggleCinema() {{ document.body.classList.toggle('cinema'); player.trigger('resize'); }}
             
@@ -564,48 +1656,851 @@ async def dashboard():
     </body>
     </html>
     """
-    return HTMLResponse(html_content)
+    return html_content
+
+# --- ROUTE: LIBRARY ---
+@app.get("/")
+async def library():
+    items = "".join(
+        f'<li><a href="/c/{quote(key, safe="")}/">{escape(info.get("title") or key)}</a> <small>{escape(info.get("author") or "")}</small></li>'
+        for key, info in read_courses().items()
+    )
+    html = f'<!DOCTYPE html><html><head><meta charset="UTF-8"><title>TELO Library</title></head><body style="background:#0a0a0a;color:#ededed;font-family:sans-serif"><h2>📚 TELO Library</h2><ul>{items}</ul></body></html>'
+    return Response(html, media_type="text/html")
+
+# --- ROUTE: DASHBOARD ---
+# Rendered once per structure version of each course; each encoding is compressed once and reused.
+# Strong ETags (one per encoding) let a refresh come back as a bodyless 304.
+
+def pick_encoding(accept_encoding):
+    offered = set()
+    for token in accept_encoding.lower().split(","):
+        name, _, params = token.partition(";")
+        if not re.search(r"q\s*=\s*0(\.0*)?\s*$", params): offered.add(name.strip())
+    if brotli and "br" in offered: return "br"
+    if "gzip" in offered: return "gzip"
+    return "identity"
+
+def etag_matches(if_none_match, etag):
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+@app.get("/c/{short_id}/")
+async def dashboard(short_id: str, request: Request):
+    course = get_course(short_id)
+    if not course: return Response("Unknown course", status_code=404)
+    dashboard_cache = course["page"]
+    key = (course["version"], course["channel_title"])
+    if dashboard_cache["key"] != key:
+        html = render_dashboard(course).encode()
+        dashboard_cache.update(key=key, tag=hashlib.sha256(html).hexdigest()[:20], bodies={"identity": html})
+
+    encoding = pick_encoding(request.headers.get("Accept-Encoding", ""))
+    etag = f'"{dashboard_cache["tag"]}"' if encoding == "identity" else f'"{dashboard_cache["tag"]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("If-None-Match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    bodies = dashboard_cache["bodies"]
+    if encoding not in bodies:
+        html = bodies["identity"]
+        bodies[encoding] = brotli.compress(html) if encoding == "br" else gzip.compress(html, mtime=0)
+    if encoding != "identity": headers["Content-Encoding"] = encoding
+    return Response(bodies[encoding], media_type="text/html", headers=headers)
+
+# --- ROUTE: COURSE STRUCTURE API ---
+# Lessons are paged in course order; the first page also carries module ranges and every lesson id
+def structure_listing(course):
+    structure_cache = course["listing"]
+    if structure_cache["version"] != course["version"]:
+        modules, lessons = [], []
+        for name, videos in course["structure"].items():
+            modules.append({"name": name, "start": len(lessons), "count": len(videos)})
+            lessons.extend({"id": vid["id"], "title": vid["title"], "thumb": vid["doc"][0] if vid.get("thumb", True) and "doc" in vid else None} for vid in videos)
+        structure_cache.update(version=course["version"], modules=modules, lessons=lessons, ids=[l["id"] for l in lessons])
+    return structure_cache
+
+@app.get("/c/{short_id}/api/structure")
+async def api_structure(short_id: str, offset: int = 0, limit: int = 200):
+    course = get_course(short_id)
+    if not course: return Response("Unknown course", status_code=404)
+    listing = structure_listing(course)
+    offset, limit = max(offset, 0), max(1, min(limit, 1000))
+    page = {
+        "version": course["version"], "total": len(listing["lessons"]), "offset": offset,
+        "lessons": listing["lessons"][offset:offset + limit],
+    }
+    if offset == 0:
+        course_structure = course["structure"]
+        page["status"] = course["status"]
+        page["flat"] = len(course_structure) == 1 and "Course Content" in course_structure
+        page["modules"] = listing["modules"]
+        page["lesson_ids"] = listing["ids"]
+    return page
+
+# --- ROUTE: WATCH PROGRESS ---
+# GET returns every lesson's saved position; POST takes a batch {"lessons": {msg_id: {position, duration, done}}}
+@app.get("/c/{short_id}/api/progress")
+async def get_progress(short_id: str):
+    course = get_course(short_id)
+    if not course: return Response("Unknown course", status_code=404)
+    return {"lessons": read_progress(course["key"])}
+
+@app.post("/c/{short_id}/api/progress")
+async def post_progress(short_id: str, request: Request):
+    course = get_course(short_id)
+    if not course: return Response("Unknown course", status_code=404)
+    try:
+        lessons = (await request.json())["lessons"]
+        for msg_id, entry in lessons.items():
+            note_progress(course["key"], int(msg_id), max(float(entry.get("position") or 0), 0), float(entry.get("duration") or 0), bool(entry.get("done")))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return Response("Bad progress batch", status_code=400)
+    return {"saved": len(lessons)}
+
+# --- ROUTE: LIVE STRUCTURE EVENTS (SSE) ---
+# An open events stream keeps its course loaded
+@app.get("/c/{short_id}/api/events")
+async def structure_events(short_id: str):
+    course = get_course(short_id)
+    if not course: return Response("Unknown course", status_code=404)
+    async def event_stream():
+        course["listeners"] += 1
+        sent = None
+        try:
+            while True:
+                changed = course["changed"]
+                state = (course["version"], course["status"]["state"])
+                if state != sent:
+                    sent = state
+                    yield f"data: {json.dumps({'version': course['version'], 'status': course['status']})}\n\n"
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            course["listeners"] -= 1
+            course["last_used"] = time.monotonic()
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # --- ROUTE: STREAMING ---
-async def iter_file(msg_media, start_byte, total_to_send):
-    bytes_sent = 0
-    async for chunk in client.iter_download(msg_media, offset=start_byte, request_size=512*1024):
-        if bytes_sent >= total_to_send: break
-        left_to_send = total_to_send - bytes_sent
-        chunk = chunk[:left_to_send] if len(chunk) > left_to_send else chunk
-        yield chunk
-        bytes_sent += len(chunk)
-
-@app.get("/stream/{msg_id}")
-async def stream_video(msg_id: int, request: Request):
+# Concurrent readers of a chunk (other viewers, scrubbing, prefetch) share one upstream download.
+# The download is cancelled only once every reader waiting on it has gone away.
+# A more urgent reader joining a queued download moves it up to its class.
+async def read_chunk(course, msg_id, media, idx, kind="playback"):
+    key = (media["location"].id, idx)
+    data = cache_get(key)
+    if data is not None: return data
+
+    entry = inflight_chunks.get(key)
+    if entry:
+        STREAM_STATS["coalesced"] += 1
+        bump_ticket(entry["ticket"], kind)
+    else:
+        ticket = new_ticket(kind)
+        entry = {"task": asyncio.create_task(download_chunk(course, msg_id, key, media, ticket)), "waiters": 0, "ticket": ticket}
+        inflight_chunks[key] = entry
+        entry["task"].add_done_callback(lambda _: inflight_chunks.pop(key) if inflight_chunks.get(key) is entry else None)
+    entry["waiters"] += 1
     try:
-        msg = await client.get_messages(target_entity, ids=msg_id)
-        if not msg or not msg.media: return Response("Not Found", status_code=404)
-        file_size = msg.file.size
-        
+        return await asyncio.shield(entry["task"])
+    finally:
+        entry["waiters"] -= 1
+        if not entry["waiters"] and not entry["task"].done():
+            entry["task"].cancel()
+            if inflight_chunks.get(key) is entry: inflight_chunks.pop(key)
+
+async def download_chunk(course, msg_id, key, media, ticket, cache=True):
+    idx = key[1]
+    try:
+        data = await fetch_chunk(media, idx, ticket)
+    except (errors.FileReferenceExpiredError, errors.FilerefUpgradeNeededError):
+        media = await refresh_lesson_media(course, msg_id, ticket["kind"])
+        if not media: raise
+        data = await fetch_chunk(media, idx, ticket)
+    if cache and len(data) == min(CHUNK_SIZE, media["size"] - idx * CHUNK_SIZE):
+        cache_put(key, data)
+    return data
+
+# Serves [start, end] chunk by chunk, keeping up to download_connections chunks in flight and yielding in order.
+# Stops as soon as the browser disconnects; a parked (superseded) stream only fetches what is read from it.
+# Time spent waiting for chunks (upstream side) and inside yield (client/HTTP side) is measured separately.
+async def iter_file(course, msg_id, media, start, end, request=None, opened=None):
+    opened = opened or time.monotonic()
+    waited = sent = 0.0
+    served = 0
+    first, last = start // CHUNK_SIZE, end // CHUNK_SIZE
+    viewer = request.client.host if request and request.client else None
+    kind = stream_kind(viewer, course, msg_id, first)
+    stream = open_stream(viewer, course, msg_id)
+    pending = stream["pending"]
+    watcher = asyncio.create_task(watch_disconnect(request, stream)) if request and CONFIG["abort_on_disconnect"] else None
+    stopped = asyncio.create_task(stream["stop"].wait())
+    finished = False
+    try:
+        for idx in range(first, last + 1):
+            window = 1 if stream["parked"] else CONFIG["download_connections"]
+            for ahead in range(idx, min(idx + window, last + 1)):
+                if ahead not in pending:
+                    pending[ahead] = asyncio.create_task(read_chunk(course, msg_id, media, ahead, kind))
+            chunk_task = pending.pop(idx)
+            wait_started = time.monotonic()
+            await asyncio.wait({chunk_task, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if stream["stop"].is_set():
+                chunk_task.cancel()
+                return
+            try:
+                data = slice_chunk(chunk_task.result(), idx, start, end)
+            except Exception as e:
+                # Headers are already sent, so the body just ends here
+                stream_failed(msg_id, e)
+                return
+            send_started = time.monotonic()
+            waited += send_started - wait_started
+            observe("telo_stream_chunk_wait_seconds", send_started - wait_started)
+            if not served: observe("telo_stream_ttfb_seconds", send_started - opened, source="telegram", kind=kind)
+            yield data
+            sent += time.monotonic() - send_started
+            served += len(data)
+            STREAM_STATS["bytes_served"] += len(data)
+            note_playback(viewer, course, msg_id, media, idx, last)
+        finished = True
+    finally:
+        if not finished: STREAM_STATS["aborted"] += 1
+        trace("stream", course=course["key"], lesson=msg_id, range=[start, end], kind=kind, viewer=viewer, bytes=served,
+              seconds=round(time.monotonic() - opened, 4), chunk_wait=round(waited, 4), send=round(sent, 4), aborted=not finished)
+        for task in pending.values(): task.cancel()
+        for task in (watcher, stopped):
+            if task: task.cancel()
+        close_stream(viewer, course, msg_id, stream)
+
+def slice_chunk(data, idx, start, end):
+    chunk_start = idx * CHUNK_SIZE
+    return data[max(start - chunk_start, 0):end + 1 - chunk_start]
+
+# --- HELPER: IN-FLIGHT STREAMS ---
+# Streams are tracked per (viewer, course, lesson). Scrubbing opens a new range request each time, so beyond
+# streams_per_lesson the oldest ones are parked: their read-ahead is cancelled and they stop fetching ahead.
+def open_stream(viewer, course, msg_id):
+    stream = {"stop": asyncio.Event(), "parked": False, "pending": {}}
+    streams = active_streams.setdefault((viewer, course["key"], msg_id), [])
+    streams.append(stream)
+    if not CONFIG["abort_on_disconnect"]: return stream
+    for old in streams[:-CONFIG["streams_per_lesson"]]:
+        if not old["parked"]: park_stream(old)
+    return stream
+
+def park_stream(stream):
+    stream["parked"] = True
+    for task in stream["pending"].values(): task.cancel()
+    stream["pending"].clear()
+
+def close_stream(viewer, course, msg_id, stream):
+    key = (viewer, course["key"], msg_id)
+    streams = active_streams.get(key, [])
+    if stream in streams: streams.remove(stream)
+    if not streams: active_streams.pop(key, None)
+    course["last_used"] = time.monotonic()
+
+async def watch_disconnect(request, stream):
+    while not await request.is_disconnected():
+        await asyncio.sleep(0.25)
+    stream["stop"].set()
+
+# --- HELPER: READ-AHEAD PREFETCH ---
+# One prefetcher per viewer: fills the chunk cache prefetch_ahead_mb past the last served chunk,
+# then warms the first next_lesson_mb of the next lesson. A seek or lesson switch restarts it.
+# Chunks up to request_last are left to the serving iter_file, which already has them in flight.
+# Both windows are clamped to what the chunk cache can hold, and each chunk is fetched once per run:
+# one the cache could not keep is not downloaded again.
+# A range that starts at the top of the file or right where this viewer was playing is playback;
+# a jump anywhere else (scrubbing, tail probes) is a seek
+def cache_chunks(mb):
+    return min(mb, CONFIG["cache_size_mb"]) * 1024 * 1024 // CHUNK_SIZE
+
+def stream_kind(viewer, course, msg_id, first):
+    state = prefetchers.get(viewer)
+    ahead = cache_chunks(CONFIG["prefetch_ahead_mb"])
+    if first == 0 or (state and state["key"] == (course["key"], msg_id) and state["idx"] <= first <= state["idx"] + ahead + 1):
+        return "playback"
+    return "seek"
+
+def note_playback(viewer, course, msg_id, media, idx, request_last):
+    state = prefetchers.get(viewer)
+    ahead = cache_chunks(CONFIG["prefetch_ahead_mb"])
+    if state and state["key"] == (course["key"], msg_id) and state["idx"] <= idx <= state["idx"] + ahead:
+        state.update(idx=idx, request_last=request_last)
+        state["wake"].set()
+        return
+    stop_prefetch(viewer)
+    state = {"key": (course["key"], msg_id), "idx": idx, "request_last": request_last, "fetched": set(), "wake": asyncio.Event()}
+    state["task"] = asyncio.create_task(run_prefetch(state, course, media))
+    prefetchers[viewer] = state
+
+def stop_prefetch(viewer):
+    state = prefetchers.pop(viewer, None)
+    if state: state["task"].cancel()
+
+async def run_prefetch(state, course, media):
+    doc_id, msg_id = media["location"].id, state["key"][1]
+    last = (media["size"] - 1) // CHUNK_SIZE
+    warmed_next = False
+    try:
+        while True:
+            state["wake"].clear()
+            ahead = cache_chunks(CONFIG["prefetch_ahead_mb"])
+            first = min(state["idx"] + CONFIG["download_connections"], state["request_last"] + 1)
+            window = range(first, min(state["idx"] + ahead, last) + 1)
+            missing = next((i for i in window if i not in state["fetched"] and (doc_id, i) not in chunk_lru), None)
+            if missing is not None:
+                await read_chunk(course, msg_id, media, missing, "prefetch")
+                state["fetched"].add(missing)
+                continue
+            if state["idx"] + ahead >= last and not warmed_next:
+                warmed_next = True
+                await warm_next_lesson(course, msg_id)
+                continue
+            await state["wake"].wait()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        log(f"⚠️ Prefetch stopped: {e}")
+
+async def warm_next_lesson(course, msg_id):
+    lesson_ids = [vid['id'] for videos in course["structure"].values() for vid in videos]
+    if msg_id not in lesson_ids or lesson_ids[-1] == msg_id: return
+    next_id = lesson_ids[lesson_ids.index(msg_id) + 1]
+    if os.path.exists(mirror_path(course["key"], next_id)): return
+    media = await get_lesson_media(course, next_id, "prefetch")
+    if not media: return
+    warm_chunks = min(cache_chunks(CONFIG["next_lesson_mb"]), (media["size"] - 1) // CHUNK_SIZE + 1)
+    for idx in range(warm_chunks):
+        if (media["location"].id, idx) not in chunk_lru:
+            await read_chunk(course, next_id, media, idx, "prefetch")
+    await locate_boxes(course, next_id, media, "prefetch")
+    log(f"🔥 Warmed next lesson {next_id} ({warm_chunks} MB)")
+
+# A lesson left half-watched: right after reading the header the player seeks to the saved position, so the
+# chunks around its byte estimate (same share of the file as of the duration) are fetched while it does
+async def warm_resume(course, msg_id, media):
+    saved = read_progress(course["key"]).get(msg_id)
+    if not saved or saved["done"] or saved["position"] < 10 or not saved["duration"]: return
+    idx = int(media["size"] * min(saved["position"] / saved["duration"], 1)) // CHUNK_SIZE
+    last = (media["size"] - 1) // CHUNK_SIZE
+    window = [i for i in range(max(idx - 1, 0), min(idx + 1, last) + 1) if (media["location"].id, i) not in chunk_lru]
+    try:
+        await asyncio.gather(*(read_chunk(course, msg_id, media, i, "prefetch") for i in window))
+    except Exception as e:
+        log(f"⚠️ Could not warm the resume point of {msg_id}: {e}")
+
+# --- HELPER: MP4 BOX LOCATOR ---
+# Lessons that are not "faststart" keep moov (the sample tables the player needs first) at the end of the file,
+# so a cold start reads the top and then the tail. The first time a lesson is played or warmed, its top-level
+# boxes are walked once; ftyp and moov bytes go to cache/boxes/<doc id>/ (outside the chunk LRU) and their
+# ranges to the course index. Range requests that fall inside one of them are then answered from disk.
+MAX_BOX_MB = 16
+
+def box_path(doc_id, region_start):
+    return os.path.join(BOX_CACHE_DIR, str(doc_id), str(region_start))
+
+async def locate_boxes(course, msg_id, media, kind):
+    if "boxes" in media: return
+    locating = course["locating"]
+    if msg_id not in locating:
+        locating[msg_id] = asyncio.ensure_future(find_boxes(course, msg_id, media, kind))
+        locating[msg_id].add_done_callback(lambda _: locating.pop(msg_id, None))
+    try:
+        await asyncio.shield(locating[msg_id])
+    except Exception as e:
+        log(f"⚠️ Could not read the MP4 layout of {msg_id}: {e}")
+
+async def find_boxes(course, msg_id, media, kind):
+    size = media["size"]
+    async def read(pos, length):
+        first = pos // CHUNK_SIZE
+        data = b"".join([await read_chunk(course, msg_id, media, idx, kind) for idx in range(first, (pos + length - 1) // CHUNK_SIZE + 1)])
+        return data[pos - first * CHUNK_SIZE:pos - first * CHUNK_SIZE + length]
+
+    boxes, pos = {}, 0
+    while pos + 8 <= size and len(boxes) < 64:
+        header = await read(pos, min(16, size - pos))
+        box_size, box_type = struct.unpack(">I4s", header[:8])
+        if box_size == 1 and len(header) == 16: box_size = struct.unpack(">Q", header[8:16])[0]
+        elif box_size == 0: box_size = size - pos
+        if box_size < 8 or (pos == 0 and box_type != b"ftyp"): break
+        boxes.setdefault(box_type, (pos, min(pos + box_size, size)))
+        if box_type == b"moov": break
+        pos += box_size
+
+    regions = []
+    for box_type in (b"ftyp", b"moov"):
+        if box_type not in boxes: continue
+        start, end = boxes[box_type]
+        if end - start > MAX_BOX_MB * 1024 * 1024: continue
+        data = await read(start, end - start)
+        path = box_path(media["location"].id, start)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as f: f.write(data)
+        os.replace(path + ".tmp", path)
+        regions.append([start, end])
+
+    moov, mdat = boxes.get(b"moov"), boxes.get(b"mdat")
+    layout = {"doc": media["location"].id, "faststart": bool(moov and (not mdat or moov[0] < mdat[0])), "regions": regions}
+    media["boxes"] = layout
+    for rec in (course["index"] or {}).get("records", []):
+        if rec["id"] == msg_id and "title" in rec:
+            rec["boxes"] = layout
+            course["index"]["dirty"] = True
+    if moov and not layout["faststart"]: log(f"🎯 moov of lesson {msg_id} cached ({(moov[1] - moov[0]) // 1024} KB at the tail)")
+
+# [start, end] from the box cache, or None when it is not inside one cached box
+def read_box_range(media, start, end):
+    layout = media.get("boxes")
+    if not layout or layout["doc"] != media["location"].id: return None
+    for region_start, region_end in layout["regions"]:
+        if region_start <= start and end < region_end:
+            try:
+                with open(box_path(layout["doc"], region_start), 'rb') as f:
+                    f.seek(start - region_start)
+                    data = f.read(end - start + 1)
+            except OSError:
+                return None
+            if len(data) != end - start + 1: return None
+            STREAM_STATS["box_hits"] += 1
+            return data
+    return None
+
+# --- HELPER: RANGE PLANNER ---
+# Maps a Range header to (status, start, end): 200 whole file, 206 partial, 416 unsatisfiable.
+# Malformed and multi-range headers are ignored (whole file), as RFC 9110 allows.
+def plan_range(range_header, file_size):
+    whole = (200, 0, file_size - 1)
+    match = re.fullmatch(r"\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*", range_header or "")
+    if not match or not (match.group(1) or match.group(2)): return whole
+
+    if not match.group(1):
+        suffix = int(match.group(2))
+        if suffix == 0 or file_size == 0: return (416, 0, 0)
+        return (206, max(file_size - suffix, 0), file_size - 1)
+
+    start = int(match.group(1))
+    end = int(match.group(2)) if match.group(2) else file_size - 1
+    if match.group(2) and end < start: return whole
+    if start >= file_size: return (416, 0, 0)
+    return (206, start, min(end, file_size - 1))
+
+# Mirrored lessons come straight off the disk (FileResponse does the ranges) without touching Telegram.
+# The ETag matches the streamed one, so If-Range keeps working when a lesson becomes mirrored.
+def serve_mirror(course, msg_id):
+    path = mirror_path(course["key"], msg_id)
+    media = course["media"].get(msg_id)
+    if not os.path.exists(path) or (media and os.path.getsize(path) != media["size"]): return None
+    headers = {"ETag": f'"{media["location"].id}-{media["size"]}"'} if media else {}
+    return FileResponse(path, media_type="video/mp4", headers=headers)
+
+# A body cut short by an upstream error (iter_file stops after stream_failed) is never closed as complete:
+# the connection is dropped instead, so the player sees a failed read and retries the range
+class VideoStream(StreamingResponse):
+    async def stream_response(self, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        sent = 0
+        async for chunk in self.body_iterator:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            sent += len(chunk)
+        if sent == int(self.headers["content-length"]):
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+# Upstream fetches are always whole CHUNK_SIZE blocks (cached and shared); iter_file slices them locally
+@app.api_route("/c/{short_id}/stream/{msg_id}", methods=["GET", "HEAD"])
+async def stream_video(short_id: str, msg_id: int, request: Request):
+    opened = time.monotonic()
+    try:
+        course = get_course(short_id)
+        if not course: return Response("Unknown course", status_code=404)
+        mirrored = serve_mirror(course, msg_id)
+        if mirrored:
+            observe("telo_stream_ttfb_seconds", time.monotonic() - opened, source="mirror", kind="file")
+            trace("stream", course=course["key"], lesson=msg_id, source="mirror", range=request.headers.get("Range"))
+            return mirrored
+        media = await get_lesson_media(course, msg_id)
+        if not media: return Response("Not Found", status_code=404)
+        file_size = media["size"]
+        etag = f'"{media["location"].id}-{file_size}"'
+        headers = {"Accept-Ranges": "bytes", "ETag": etag, "Content-Type": "video/mp4"}
+
         range_header = request.headers.get("Range")
-        if range_header:
-            byte_match = re.search(r"bytes=(\d+)-(\d*)", range_header)
-            start = int(byte_match.group(1))
-            end = int(byte_match.group(2)) if byte_match.group(2) else file_size - 1
-            content_length = end - start + 1
-            return StreamingResponse(
-                iter_file(msg.media, start, content_length), 
-                status_code=206, 
-                headers={
-                    "Content-Range": f"bytes {start}-{end}/{file_size}", 
-                    "Accept-Ranges": "bytes", 
-                    "Content-Length": str(content_length), 
-                    "Content-Type": "video/mp4"
-                }
-            )
-        return StreamingResponse(iter_file(msg.media, 0, file_size), media_type="video/mp4")
+        if_range = request.headers.get("If-Range")
+        if if_range and if_range.strip() != etag: range_header = None
+        status, start, end = plan_range(range_header, file_size)
+
+        if status == 416:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{file_size}"})
+        if status == 206:
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+        headers["Content-Length"] = str(end - start + 1)
+
+        if request.method == "HEAD" or file_size == 0:
+            return Response(status_code=status, headers=headers)
+        boxed = read_box_range(media, start, end)
+        if boxed is not None:
+            STREAM_STATS["bytes_served"] += len(boxed)
+            observe("telo_stream_ttfb_seconds", time.monotonic() - opened, source="box", kind="file")
+            trace("stream", course=course["key"], lesson=msg_id, source="box", range=[start, end], bytes=len(boxed))
+            return Response(boxed, status_code=status, headers=headers)
+        if "boxes" not in media and msg_id not in course["locating"]:
+            # The player's tail probe follows right after it reads the top; start on it now
+            asyncio.create_task(locate_boxes(course, msg_id, media, "seek"))
+        if (media["location"].id, start // CHUNK_SIZE) not in chunk_lru: check_sessions("playback")
+        if start == 0: asyncio.create_task(warm_resume(course, msg_id, media))
+        return VideoStream(iter_file(course, msg_id, media, start, end, request, opened), status_code=status, headers=headers)
+    except errors.FloodWaitError as e:
+        stream_failed(msg_id, e)
+        return Response("Telegram asked us to slow down", status_code=503, headers={"Retry-After": str(e.seconds)})
     except Exception as e:
-        log(f"Stream Error: {e}")
+        stream_failed(msg_id, e)
         return Response("Error", status_code=500)
 
+def stream_failed(msg_id, e):
+    STREAM_STATS["errors"] += 1
+    if isinstance(e, errors.FloodWaitError):
+        trace("stream_error", lesson=msg_id, error="FloodWait", seconds=e.seconds)
+        log(f"⏸️ Stream of {msg_id} stopped, Telegram asked to wait {e.seconds}s")
+    else:
+        trace("stream_error", lesson=msg_id, error=f"{type(e).__name__}: {e}")
+        log(f"Stream Error: {e}")
+
+# --- ROUTE: LESSON THUMBNAILS ---
+# The sidebar asks for thumb/<msg id>?v=<doc id>, so a cached image never outlives the video it shows
+@app.get("/c/{short_id}/thumb/{msg_id}")
+async def lesson_thumb(short_id: str, msg_id: int):
+    course = get_course(short_id)
+    if not course: return Response("Unknown course", status_code=404)
+    try:
+        path = await get_thumb(course, msg_id)
+    except errors.FloodWaitError as e:
+        return Response(status_code=503, headers={"Retry-After": str(e.seconds)})
+    except Exception as e:
+        log(f"Thumbnail Error: {e}")
+        return Response(status_code=404, headers={"Cache-Control": "max-age=300"})
+    if not path: return Response(status_code=404, headers={"Cache-Control": "max-age=86400"})
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+# --- ROUTE: STREAM STATS ---
+@app.get("/api/streams")
+async def stream_stats():
+    active = [{"viewer": viewer, "course": course_key, "lesson": msg_id, "streams": len(streams)} for (viewer, course_key, msg_id), streams in active_streams.items()]
+    loaded = [{"course": course["key"], "state": course["status"]["state"], "viewers": course["listeners"]} for course in courses.values()]
+    now = time.monotonic()
+    sessions = [{
+        "session": session["label"], "busy": session["busy"], "paused_for": max(0, round(session["benched_until"] - now)),
+        "background_paused_for": max(0, round(session["background_until"] - now)),
+        "fetched_mb": round(session["fetched"] / 1048576, 1), "flood_waits": session["flood_waits"], "errors": session["errors"],
+    } for session in session_pool]
+    return {"active": active, "courses": loaded, "sessions": sessions, **STREAM_STATS}
+
+# --- ROUTE: UPSTREAM SCHEDULER STATS ---
+@app.get("/api/upstream")
+async def upstream_stats():
+    now = time.monotonic()
+    return {kind: {
+        "queued": sum(1 for ticket in scheduler["queues"][kind] if not ticket["future"].done()),
+        "running": scheduler["running"][kind],
+        "paused_for": max(0, round(scheduler["paused_until"][kind] - now)),
+        "granted": SCHED_STATS[kind]["granted"], "flood_waits": SCHED_STATS[kind]["flood_waits"],
+        "avg_wait_ms": round(SCHED_STATS[kind]["wait_seconds"] * 1000 / SCHED_STATS[kind]["granted"], 1) if SCHED_STATS[kind]["granted"] else 0.0,
+    } for kind in PRIORITIES}
+
+# --- ROUTE: CACHE STATS ---
+@app.get("/api/cache")
+async def cache_stats():
+    lookups = CACHE_STATS["hits"] + CACHE_STATS["misses"]
+    return {
+        "hits": CACHE_STATS["hits"], "misses": CACHE_STATS["misses"],
+        "hit_ratio": round(CACHE_STATS["hits"] / lookups, 3) if lookups else 0.0,
+        "evictions": CACHE_STATS["evictions"], "chunks": len(chunk_lru),
+        "size_mb": round(CACHE_STATS["bytes"] / 1048576, 1), "limit_mb": CONFIG["cache_size_mb"],
+    }
+
+# --- ROUTE: PROMETHEUS METRICS ---
+# Everything is read from counters the server keeps anyway; a scrape costs one pass over them.
+METRIC_HELP = {
+    "telo_stream_ttfb_seconds": ("histogram", "Time from stream request to first byte (source: telegram, box, mirror)"),
+    "telo_stream_chunk_wait_seconds": ("histogram", "Time a stream waited for each chunk it served"),
+    "telo_upstream_wait_seconds": ("histogram", "Time Telegram calls queued in the scheduler, per class"),
+    "telo_upstream_call_seconds": ("histogram", "Duration of scheduled Telegram calls other than chunk downloads, per class"),
+    "telo_chunk_download_seconds": ("histogram", "Duration of 1 MB chunk downloads, per class"),
+    "telo_part_rpc_seconds": ("histogram", "Latency of single upload.GetFile requests"),
+    "telo_index_seconds": ("histogram", "Duration of course indexing runs"),
+    "telo_bytes_served_total": ("counter", "Video bytes sent to players"),
+    "telo_bytes_fetched_total": ("counter", "Video bytes downloaded from Telegram"),
+    "telo_bytes_wasted_total": ("counter", "Downloaded bytes of cancelled fetches"),
+    "telo_streams_aborted_total": ("counter", "Streams that ended before their range was served"),
+    "telo_stream_errors_total": ("counter", "Stream requests answered with an error"),
+    "telo_chunks_coalesced_total": ("counter", "Chunk reads that joined a download already in flight"),
+    "telo_box_hits_total": ("counter", "Range requests answered from cached MP4 boxes"),
+    "telo_active_streams": ("gauge", "Streams being served"),
+    "telo_loaded_courses": ("gauge", "Courses loaded in memory"),
+    "telo_chunk_cache_hits_total": ("counter", "Chunk cache hits"),
+    "telo_chunk_cache_misses_total": ("counter", "Chunk cache misses"),
+    "telo_chunk_cache_evictions_total": ("counter", "Chunks evicted from the cache"),
+    "telo_chunk_cache_bytes": ("gauge", "Size of the chunk cache"),
+    "telo_chunk_cache_hit_ratio": ("gauge", "Chunk cache hits / lookups since start"),
+    "telo_upstream_queued": ("gauge", "Telegram calls waiting, per class"),
+    "telo_upstream_running": ("gauge", "Telegram calls in flight, per class"),
+    "telo_upstream_flood_waits_total": ("counter", "FloodWaits hit, per class"),
+    "telo_session_fetched_bytes_total": ("counter", "Bytes downloaded, per session"),
+    "telo_session_busy": ("gauge", "Chunk downloads in flight, per session"),
+    "telo_index_messages_scanned_total": ("counter", "Channel messages read by index scans"),
+    "telo_index_records": ("gauge", "Modules and lessons in a loaded course index"),
+    "telo_index_last_seconds": ("gauge", "Duration of the last indexing run of a loaded course"),
+}
+
+def prom_labels(labels):
+    if not labels: return ""
+    escape_value = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape_value(value)}"' for name, value in labels) + "}"
+
+@app.get("/metrics")
+async def metrics():
+    samples = {name: [] for name in METRIC_HELP}
+    def add(name, value, **labels): samples[name].append((tuple(labels.items()), value))
+
+    for source, name in (("bytes_served", "telo_bytes_served_total"), ("bytes_fetched", "telo_bytes_fetched_total"),
+                         ("bytes_wasted", "telo_bytes_wasted_total"), ("aborted", "telo_streams_aborted_total"),
+                         ("errors", "telo_stream_errors_total"), ("coalesced", "telo_chunks_coalesced_total"),
+                         ("box_hits", "telo_box_hits_total")):
+        add(name, STREAM_STATS[source])
+    add("telo_active_streams", sum(len(streams) for streams in active_streams.values()))
+    add("telo_loaded_courses", len(courses))
+    lookups = CACHE_STATS["hits"] + CACHE_STATS["misses"]
+    add("telo_chunk_cache_hits_total", CACHE_STATS["hits"])
+    add("telo_chunk_cache_misses_total", CACHE_STATS["misses"])
+    add("telo_chunk_cache_evictions_total", CACHE_STATS["evictions"])
+    add("telo_chunk_cache_bytes", CACHE_STATS["bytes"])
+    add("telo_chunk_cache_hit_ratio", round(CACHE_STATS["hits"] / lookups, 4) if lookups else 0)
+    for kind in PRIORITIES:
+        add("telo_upstream_queued", sum(1 for ticket in scheduler["queues"][kind] if not ticket["future"].done()), **{"class": kind})
+        add("telo_upstream_running", scheduler["running"][kind], **{"class": kind})
+        add("telo_upstream_flood_waits_total", SCHED_STATS[kind]["flood_waits"], **{"class": kind})
+    for session in session_pool:
+        add("telo_session_fetched_bytes_total", session["fetched"], session=session["label"])
+        add("telo_session_busy", session["busy"], session=session["label"])
+    add("telo_index_messages_scanned_total", INDEX_STATS["messages_scanned"])
+    for course in courses.values():
+        if course["index"] is not None: add("telo_index_records", len(course["index"]["records"]), course=course["key"])
+        if course["indexing"]: add("telo_index_last_seconds", course["indexing"]["seconds"], course=course["key"])
+
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind != "histogram":
+            lines += [f"{name}{prom_labels(labels)} {value}" for labels, value in samples[name]]
+            continue
+        for (hist_name, labels), hist in histograms.items():
+            if hist_name != name: continue
+            total = 0
+            for bound, count in zip(LATENCY_BUCKETS, hist["buckets"]):
+                total += count
+                lines.append(f"{name}_bucket{prom_labels(labels + (('le', bound),))} {total}")
+            lines.append(f"{name}_bucket{prom_labels(labels + (('le', '+Inf'),))} {hist['count']}")
+            lines.append(f"{name}_sum{prom_labels(labels)} {round(hist['sum'], 6)}")
+            lines.append(f"{name}_count{prom_labels(labels)} {hist['count']}")
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# --- OFFLINE MIRROR ---
+# `telo download` copies every lesson to mirror/<course>/<msg id>.mp4. Files are written as .part in
+# chunk order, so an interrupted run resumes at the last whole chunk; chunks already in the cache are reused.
+def mirror_path(course_key, msg_id):
+    safe_key = re.sub(r'[^\w.-]+', '_', str(course_key))
+    return os.path.join(MIRROR_DIR, safe_key, f"{msg_id}.mp4")
+
+async def mirror_chunk(course, msg_id, media, idx):
+    key = (media["location"].id, idx)
+    data = cache_get(key)
+    if data is None: data = await download_chunk(course, msg_id, key, media, new_ticket("prefetch"), cache=False)
+    if len(data) != min(CHUNK_SIZE, media["size"] - idx * CHUNK_SIZE): raise Exception(f"short read at chunk {idx}")
+    return data
+
+async def mirror_lesson(course, rec, progress):
+    path = mirror_path(course["key"], rec["id"])
+    if os.path.exists(path) and os.path.getsize(path) == rec["size"]:
+        progress["bytes"] += rec["size"]
+        return
+    media = await get_lesson_media(course, rec["id"], "prefetch")
+    if not media: raise Exception("media not found")
+
+    part_path = path + ".part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    first = os.path.getsize(part_path) // CHUNK_SIZE if os.path.exists(part_path) else 0
+    last = (media["size"] - 1) // CHUNK_SIZE
+    progress["bytes"] += first * CHUNK_SIZE
+    pending = {}
+    with open(part_path, "r+b" if first else "wb") as f:
+        f.truncate(first * CHUNK_SIZE)
+        f.seek(first * CHUNK_SIZE)
+        try:
+            for idx in range(first, last + 1):
+                for ahead in range(idx, min(idx + CONFIG["download_connections"], last + 1)):
+                    if ahead not in pending:
+                        pending[ahead] = asyncio.create_task(mirror_chunk(course, rec["id"], media, ahead))
+                data = await pending.pop(idx)
+                f.write(data)
+                progress["bytes"] += len(data)
+                progress["fetched"] += len(data)
+        finally:
+            for task in pending.values(): task.cancel()
+    os.replace(part_path, path)
+
+async def report_progress(progress, lessons, total):
+    last_fetched, last_time = 0, time.monotonic()
+    while True:
+        await asyncio.sleep(1)
+        now = time.monotonic()
+        rate = (progress["fetched"] - last_fetched) / (now - last_time) / 1048576
+        last_fetched, last_time = progress["fetched"], now
+        print(f"\r⬇️ {progress['done']}/{lessons} lessons · {progress['bytes'] / 1048576:.0f}/{total / 1048576:.0f} MB · {rate:.1f} MB/s   ", end="", flush=True)
+
+async def download_course(course_key, info):
+    await client.start()
+    init_chunk_cache()
+    await start_session_pool()
+    course = new_course(course_key, info)
+    try:
+        await index_course(course)
+        if course["entity"] is None: return
+        lessons = [rec for rec in course["index"]["records"] if "title" in rec]
+        total = sum(rec["size"] for rec in lessons)
+        progress = {"done": 0, "bytes": 0, "fetched": 0, "failed": 0}
+        todo = deque(lessons)
+        async def worker():
+            while todo:
+                rec = todo.popleft()
+                try:
+                    await mirror_lesson(course, rec, progress)
+                except Exception as e:
+                    progress["failed"] += 1
+                    print(f"\n⚠️ {rec['title']}: {e}")
+                progress["done"] += 1
+
+        started = time.monotonic()
+        reporter = asyncio.create_task(report_progress(progress, len(lessons), total))
+        try:
+            await asyncio.gather(*(worker() for _ in range(CONFIG["download_workers"])))
+        finally:
+            reporter.cancel()
+        elapsed = max(time.monotonic() - started, 0.001)
+        print(f"\n✅ {len(lessons) - progress['failed']}/{len(lessons)} lessons mirrored to {os.path.dirname(mirror_path(course_key, 0))}"
+              f" ({progress['fetched'] / 1048576:.0f} MB fetched, {progress['fetched'] / elapsed / 1048576:.1f} MB/s)")
+    finally:
+        if course["index"] and course["index"].pop("dirty", False): save_course_index(course_key, course["index"])
+        await close_session_pool()
+        await client.disconnect()
+
+# --- ROUTE: DAEMON CONTROL ---
+# Used by the CLI only; every call carries the token the daemon wrote to daemon.json
+def daemon_authorized(request):
+    return bool(daemon_token) and secrets.compare_digest(request.headers.get("X-Telo-Token", ""), daemon_token)
+
+def course_url(course_key):
+    return f"http://localhost:{CURRENT_PORT}/c/{quote(course_key, safe='')}/"
+
+@app.post("/api/daemon/ping")
+async def daemon_ping(request: Request):
+    if not daemon_authorized(request): return Response(status_code=403)
+    return {"pid": os.getpid(), "courses": list(courses)}
+
+# Loads the course (or reloads it from scratch for reindex) so the page opens on a warm server
+@app.post("/api/daemon/open")
+async def daemon_open(request: Request):
+    if not daemon_authorized(request): return Response(status_code=403)
+    body = await request.json()
+    course_key = body.get("course")
+    if body.get("reindex") and read_course(course_key):
+        if course_key in courses: await unload_course(courses[course_key])
+        drop_course_index(course_key)
+    if not get_course(course_key): return Response("Unknown course", status_code=404)
+    return {"course": course_key, "url": course_url(course_key)}
+
+@app.post("/api/daemon/stop")
+async def daemon_stop(request: Request):
+    if not daemon_authorized(request): return Response(status_code=403)
+    daemon_server.should_exit = True
+    return {"stopping": True}
+
+# --- DAEMON: CLI SIDE ---
+# `telo play` hands the course to a long-lived background server (one Telegram connection for
+# every course, indexes kept in memory) and only starts one when none is answering.
+def read_daemon_file():
+    try:
+        with open(DAEMON_FILE) as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def daemon_request(path, payload=None, timeout=10):
+    info = read_daemon_file()
+    if not info: return None
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{info['port']}{path}", data=json.dumps(payload or {}).encode(),
+        headers={"Content-Type": "application/json", "X-Telo-Token": info["token"]},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as r: return json.loads(r.read())
+    except (OSError, ValueError):
+        return None
+
+def attach_daemon(course_key, reindex=False):
+    reply = daemon_request("/api/daemon/open", {"course": course_key, "reindex": reindex})
+    if reply: return reply["url"]
+
+    print("⏳ Starting background server...")
+    with open(DAEMON_LOG, "a") as log_file:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", course_key],
+            stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+            env={**os.environ, "PYTHONUNBUFFERED": "1"}, start_new_session=True,
+        )
+    for _ in range(300):
+        time.sleep(0.1)
+        if proc.poll() is not None: return None
+        reply = daemon_request("/api/daemon/ping")
+        if reply and reply["pid"] == proc.pid:
+            reply = daemon_request("/api/daemon/open", {"course": course_key, "reindex": reindex})
+            return reply and reply["url"]
+    return None
+
+def stop_daemon():
+    if daemon_request("/api/daemon/stop"): print("🛑 Background server stopped.")
+    else: print("ℹ️ No background server running.")
+
+def open_main_client(info):
+    global client, API_ID, API_HASH
+    API_ID, API_HASH = info['api_id'], info['api_hash']
+    with open(SESSION_FILE) as f: sess = f.read().strip()
+    # FloodWaits are raised instead of slept through, so the scheduler can pause just the affected calls
+    client = TelegramClient(StringSession(sess), int(API_ID), API_HASH, flood_sleep_threshold=0)
+
+# --- DAEMON: SERVER SIDE ---
+# Serves every course; the one it was started for only supplies the API credentials
+def serve_daemon(course_key):
+    global CURRENT_PORT, daemon_server, daemon_token
+    info = read_course(course_key)
+    if not info or not os.path.exists(SESSION_FILE): return log("❌ Nothing to serve (unknown course or no session).")
+    open_main_client(info)
+
+    CURRENT_PORT = get_free_port()
+    daemon_token = secrets.token_hex(16)
+    fd = os.open(DAEMON_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f: json.dump({"pid": os.getpid(), "port": CURRENT_PORT, "token": daemon_token}, f)
+    log(f"🌐 Daemon serving on Port: {CURRENT_PORT}")
+    daemon_server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=CURRENT_PORT))
+    try:
+        daemon_server.run()
+    finally:
+        if (read_daemon_file() or {}).get("pid") == os.getpid(): os.remove(DAEMON_FILE)
+
 # --- CLI ENTRY POINT (UPDATED LOGIN LOGIC) ---
-async def do_login(api_id=None, api_hash=None, phone=None):
+# extra=True adds the account to the download pool (sessions.json) instead of replacing the main session
+async def do_login(api_id=None, api_hash=None, phone=None, extra=False):
     # Interactive Wizard Mode for Login
     if not api_id:
         api_id = input("🔹 Enter API ID: ").strip()
@@ -624,26 +2519,38 @@ async def do_login(api_id=None, api_hash=None, phone=None):
         await temp_client.sign_in(phone, otp)
     
     session_str = temp_client.session.save()
-    with open(SESSION_FILE, "w") as f:
-        f.write(session_str)
-        
-    print(f"\n✅ LOGIN SUCCESS! Session saved to {SESSION_FILE}")
+    if extra:
+        sessions = [s for s in read_extra_sessions() if s.get("phone") != phone]
+        sessions.append({"phone": phone, "api_id": str(api_id), "api_hash": api_hash, "session": session_str})
+        fd = os.open(SESSIONS_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f: json.dump(sessions, f, indent=4)
+        print(f"\n✅ LOGIN SUCCESS! Download session added ({len(sessions)} extra in {SESSIONS_FILE})")
+    else:
+        with open(SESSION_FILE, "w") as f:
+            f.write(session_str)
+        print(f"\n✅ LOGIN SUCCESS! Session saved to {SESSION_FILE}")
     await temp_client.disconnect()
 
 def run_engine():
-    global client, API_ID, API_HASH, CHANNEL_INPUT, CURRENT_PORT
+    global COURSE_KEY
     if len(sys.argv) < 2: return
     
     cmd = sys.argv[1]
+    load_config()
     
     # 1. LOGIN (Corrected)
     if cmd == "login":
-        if len(sys.argv) >= 5:
+        if len(sys.argv) >= 3 and sys.argv[2] == "add":
+            # Extra download account: login add [<id> <hash> <phone>]
+            asyncio.run(do_login(*sys.argv[3:6], extra=True))
+        elif len(sys.argv) >= 5:
             # Manual Mode: login <id> <hash> <phone>
             asyncio.run(do_login(sys.argv[2], sys.argv[3], sys.argv[4]))
         else:
             # Interactive Mode: just 'login'
             asyncio.run(do_login())
+        # A running daemon still holds the old session
+        if read_daemon_file(): stop_daemon()
             
     # 2. LIST 
     elif cmd == "list":
@@ -653,37 +2560,12 @@ def run_engine():
     elif cmd == "add":
         wizard_add_course()
 
-    # 4. OPEN 
-    elif cmd == "open":
-        keyword = " ".join(sys.argv[2:]) 
-        print(f"🔎 Searching for: '{keyword}'...")
-        
-        matches = load_and_search_courses(keyword)
-        
-        if not matches:
-            print(f"❌ No courses found for '{keyword}'. Use 'course-add' to create one.")
-            return
-        
-        selected = None
-        if len(matches) > 1:
-            print("\n🤔 Multiple courses found. Which one?")
-            for i, (key, info) in enumerate(matches):
-                print(f"   [{i+1}] {info.get('title')} (by {info.get('author')})")
-            
-            try:
-                choice = input("\n👉 Enter number (1, 2...): ")
-                idx = int(choice) - 1
-                selected = matches[idx][1]
-            except:
-                print("❌ Invalid selection.")
-                return
-        else:
-            selected = matches[0][1]
+    # 4. OPEN / REINDEX (full rebuild of the saved index, then open)
+    elif cmd in ("open", "reindex"):
+        COURSE_KEY, selected, lesson = choose_course(" ".join(sys.argv[2:]))
+        if not selected: return
 
-        print(f"\n🚀 Launching: {selected.get('title')}")
-        API_ID = selected['api_id']
-        API_HASH = selected['api_hash']
-        CHANNEL_INPUT = selected['channel_link']
+        print(f"\n🚀 Launching: {selected.get('title')}" + (f" → {lesson['title']}" if lesson else ""))
         
         if not os.path.exists(SESSION_FILE):
             print("❌ Session not found. Running login wizard...")
@@ -691,13 +2573,31 @@ def run_engine():
             # Reload session after login
             if not os.path.exists(SESSION_FILE): return
 
-        with open(SESSION_FILE) as f: sess = f.read().strip()
-        client = TelegramClient(StringSession(sess), int(API_ID), API_HASH)
-        
-        # FIX: Update GLOBAL CURRENT_PORT
-        CURRENT_PORT = get_free_port()
-        print(f"🌐 Server starting on Port: {CURRENT_PORT}")
-        uvicorn.run(app, host="0.0.0.0", port=CURRENT_PORT)
+        url = attach_daemon(COURSE_KEY, reindex=(cmd == "reindex"))
+        if not url: return print(f"❌ Server did not start, see {DAEMON_LOG}")
+        if cmd == "reindex": print("🧹 Saved index cleared, full re-scan started.")
+        if lesson: url += f"#lesson-{lesson['id']}"
+        print(f"🌐 Serving at {url}")
+        webbrowser.open(url)
+
+    # 5. DAEMON (started by open/reindex) / STOP
+    elif cmd == "serve" and len(sys.argv) >= 3:
+        serve_daemon(sys.argv[2])
+
+    elif cmd == "stop":
+        stop_daemon()
+
+    # 6. DOWNLOAD (offline mirror, resumable)
+    elif cmd == "download":
+        COURSE_KEY, selected, _ = choose_course(" ".join(sys.argv[2:]))
+        if not selected: return
+        if not os.path.exists(SESSION_FILE): return print("❌ Session not found. Run: telo login")
+        open_main_client(selected)
+        print(f"\n⬇️ Mirroring: {selected.get('title')}")
+        try:
+            asyncio.run(download_course(COURSE_KEY, selected))
+        except KeyboardInterrupt:
+            print("\n⏸️ Stopped. Run the same command again to resume.")
 
 if __name__ == "__main__":
     run_engine()
\ No newline at end of file
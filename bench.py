@@ -0,0 +1,352 @@
+import sys
+import os
+import json
+import time
+import random
+import socket
+import struct
+import asyncio
+import argparse
+import resource
+import tempfile
+import multiprocessing
+import threading
+import importlib.util
+from types import SimpleNamespace
+import uvicorn
+from telethon import errors, functions
+from telethon.tl import types
+
+# TELO offline benchmark: runs the real FastAPI app from .course/main.py against a simulated Telegram
+# (latency, shared bandwidth, FloodWait injection, synthetic channel) and drives it over HTTP with
+# range-request workloads. Every workload starts from a fresh module, home directory and cache.
+#
+#   python3 bench.py                          # all workloads, results in bench-results.json
+#   python3 bench.py seek viewers --viewers 50 --latency-ms 120 --flood-rate 0.01
+#   python3 bench.py --out new.json --compare bench-results.json
+
+MAIN_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".course", "main.py")
+WORKLOADS = ("index", "playback", "seek", "viewers")
+CHANNEL_ID = 1234
+MOOV_SIZE = 256 * 1024
+PATTERN = bytes(range(256)) * 8192  # 2 MB, so any part of up to 1 MB is one slice
+
+# --- SIMULATED TELEGRAM ---
+# Stands in for the TelegramClient methods main.py calls. Every request pays `latency` and moves its
+# bytes through one shared link of `bandwidth` bytes/s; any request can fail with a FloodWait.
+class FakeTelegram:
+    def __init__(self, opts):
+        self.opts = opts
+        self.random = random.Random(opts.seed)
+        self.link_free_at = 0.0
+        self.stats = {"requests": 0, "bytes": 0, "flood_waits": 0}
+        self.entity = types.Channel(id=CHANNEL_ID, title="Bench Channel", photo=types.ChatPhotoEmpty(), date=None, access_hash=1)
+        self.messages = [self.make_message(msg_id) for msg_id in range(1, opts.messages + 1)]
+        self.layouts = {}
+
+    def make_message(self, msg_id):
+        peer = types.PeerChannel(CHANNEL_ID)
+        if msg_id % self.opts.module_every == 1:
+            return types.Message(id=msg_id, peer_id=peer, date=None, message=f"MODULE: Part {msg_id // self.opts.module_every + 1}")
+        size = self.opts.video_mb * 1024 * 1024
+        doc = types.Document(
+            id=100000 + msg_id, access_hash=1, file_reference=b"ref", date=None, mime_type="video/mp4", size=size, dc_id=2,
+            attributes=[types.DocumentAttributeFilename(f"@bench - Lesson {msg_id}.mp4")],
+            thumbs=[types.PhotoSize("m", 320, 180, 4096)],
+        )
+        return types.Message(id=msg_id, peer_id=peer, date=None, message="", media=types.MessageMediaDocument(document=doc))
+
+    # ftyp, then mdat and moov (moov first with --faststart); box headers are real, payloads are a pattern
+    def layout(self, size):
+        if size not in self.layouts:
+            ftyp = struct.pack(">I4s4s", 24, b"ftyp", b"isom") + b"\0" * 12
+            mdat_size = size - 24 - MOOV_SIZE
+            order = [(b"moov", MOOV_SIZE), (b"mdat", mdat_size)] if self.opts.faststart else [(b"mdat", mdat_size), (b"moov", MOOV_SIZE)]
+            headers, pos = [(0, ftyp)], 24
+            for box, box_size in order:
+                headers.append((pos, struct.pack(">I4s", box_size, box)))
+                pos += box_size
+            self.layouts[size] = headers
+        return self.layouts[size]
+
+    def file_bytes(self, size, offset, limit):
+        limit = max(0, min(limit, size - offset))
+        data = bytearray(PATTERN[offset % 1048576:offset % 1048576 + limit])
+        for pos, header in self.layout(size):
+            if pos < offset + limit and pos + len(header) > offset:
+                lo, hi = max(pos, offset), min(pos + len(header), offset + limit)
+                data[lo - offset:hi - offset] = header[lo - pos:hi - pos]
+        return bytes(data)
+
+    async def request(self, nbytes=0):
+        self.stats["requests"] += 1
+        if self.opts.flood_rate and self.random.random() < self.opts.flood_rate:
+            self.stats["flood_waits"] += 1
+            raise errors.FloodWaitError(request=None, capture=self.opts.flood_seconds)
+        now = time.monotonic()
+        self.link_free_at = max(now, self.link_free_at) + nbytes / (self.opts.bandwidth_mbps * 1024 * 1024)
+        await asyncio.sleep(self.opts.latency_ms / 1000 + self.link_free_at - now)
+        self.stats["bytes"] += nbytes
+
+    def document(self, doc_id):
+        return self.messages[doc_id - 100001].media.document
+
+    # TelegramClient surface used by main.py
+    async def start(self): pass
+    async def connect(self): pass
+    async def disconnect(self): pass
+    def is_connected(self): return True
+    def add_event_handler(self, callback, event=None): pass
+
+    async def get_entity(self, identifier):
+        await self.request()
+        return self.entity
+
+    async def iter_dialogs(self):
+        await self.request()
+        yield SimpleNamespace(id=-1000000000000 - CHANNEL_ID, entity=self.entity)
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, reverse=False, **kwargs):
+        found = [msg for msg in self.messages if msg.id > min_id and (not max_id or msg.id < max_id)]
+        if not reverse: found.reverse()
+        for n, msg in enumerate(found[:limit]):
+            if n % 100 == 0: await self.request(100 * 200)
+            yield msg
+
+    async def get_messages(self, entity, ids=None, limit=None, **kwargs):
+        await self.request(200)
+        if ids is None: return self.messages[::-1][:limit or 1]
+        if isinstance(ids, list): return [self.messages[i - 1] if 0 < i <= len(self.messages) else None for i in ids]
+        return self.messages[ids - 1] if 0 < ids <= len(self.messages) else None
+
+    async def iter_download(self, location, offset=0, request_size=None, chunk_size=None, limit=None, file_size=None, **kwargs):
+        size = self.document(location.id).size
+        step = chunk_size or request_size or 1048576
+        for n, pos in enumerate(range(offset, size, step)):
+            if limit is not None and n >= limit: break
+            await self.request(min(step, size - pos))
+            yield self.file_bytes(size, pos, step)
+
+    async def download_file(self, location, file=None, dc_id=None, **kwargs):
+        await self.request(4096)
+        return b"\xff\xd8\xff" + b"\0" * 4093
+
+    # Parallel path: main.open_dc_sender is swapped for fake senders whose requests land here
+    async def _call(self, sender, request, flood_sleep_threshold=None):
+        if not isinstance(request, functions.upload.GetFileRequest): raise TypeError(type(request).__name__)
+        size = self.document(request.location.id).size
+        data = self.file_bytes(size, request.offset, request.limit)
+        await self.request(len(data))
+        return SimpleNamespace(bytes=data)
+
+# --- RUNNING THE REAL APP ---
+def load_main(opts, home):
+    os.environ["HOME"] = home
+    spec = importlib.util.spec_from_file_location(f"telo_bench_{os.path.basename(home)}", opts.main)
+    main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main)
+    os.makedirs(main.BASE_DIR, exist_ok=True)
+    with open(main.COURSES_FILE, "w") as f:
+        json.dump({"bench": {"title": "Bench", "channel_link": "t.me/bench", "api_id": "1", "api_hash": "x"}}, f)
+    main.CONFIG.update(json.loads(opts.config))
+    main.client = FakeTelegram(opts)
+    if not opts.iter_download:
+        async def fake_dc_sender(session, dc_id): return dc_id
+        main.open_dc_sender = fake_dc_sender
+    if not opts.verbose: main.log = lambda msg: None
+    return main
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(main):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive(): raise RuntimeError("server did not start")
+        time.sleep(0.01)
+    return server, thread, port
+
+# --- HTTP CLIENT ---
+# Raw HTTP/1.1 so time-to-first-byte is the first body byte. Each viewer connects from its own 127.0.0.x
+# address, because the server tells viewers apart by client address (read-ahead state is per viewer).
+async def fetch(port, path, first=0, last=None, read_limit=None, viewer=0):
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port, local_addr=(f"127.0.0.{viewer % 250 + 2}", 0))
+    except OSError:  # only Linux routes all of 127/8 by default; elsewhere every viewer shares one address
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    started = time.perf_counter()
+    byte_range = f"bytes={first}-{'' if last is None else last}"
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nRange: {byte_range}\r\nConnection: close\r\n\r\n".encode())
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    status = int(head[0].split()[1])
+    length = next((int(line.split(":", 1)[1]) for line in head if line.lower().startswith("content-length:")), 0)
+    wanted = min(length, read_limit) if read_limit else length
+    received, ttfb = 0, None
+    while received < wanted:
+        try: data = await reader.read(262144)
+        except ConnectionError: break
+        if not data: break
+        if ttfb is None: ttfb = time.perf_counter() - started
+        received += len(data)
+    writer.close()
+    return {"status": status, "ttfb": ttfb if ttfb is not None else time.perf_counter() - started, "bytes": received,
+            "truncated": received < wanted, "seconds": time.perf_counter() - started}
+
+async def get_json(port, path):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nConnection: close\r\n\r\n".encode())
+    body = (await reader.read()).split(b"\r\n\r\n", 1)[1]
+    writer.close()
+    return json.loads(body)
+
+async def wait_indexed(port):
+    while True:
+        page = await get_json(port, "/c/bench/api/structure?limit=1")
+        if page["status"]["state"] in ("ready", "error"): return page
+        await asyncio.sleep(0.02)
+
+# --- WORKLOADS ---
+# Each returns the list of request results; "index" returns its own figures
+async def run_index(opts, port, main):
+    started = time.perf_counter()
+    page = await wait_indexed(port)
+    seconds = time.perf_counter() - started
+    return {"seconds": round(seconds, 3), "messages": opts.messages, "lessons": len(page["lesson_ids"]),
+            "messages_per_second": round(opts.messages / seconds, 1), "state": page["status"]["state"]}
+
+async def run_playback(opts, port, lesson_ids):
+    results = []
+    for msg_id in lesson_ids[:opts.lessons]:
+        results.append(await fetch(port, f"/c/bench/stream/{msg_id}", read_limit=opts.play_mb * 1048576))
+    return results
+
+async def run_seek(opts, port, lesson_ids):
+    rng = random.Random(opts.seed)
+    size = opts.video_mb * 1048576
+    results = []
+    for _ in range(opts.seeks):
+        msg_id = rng.choice(lesson_ids[:opts.lessons])
+        results.append(await fetch(port, f"/c/bench/stream/{msg_id}", first=rng.randrange(size), read_limit=opts.seek_read_kb * 1024))
+    return results
+
+async def run_viewers(opts, port, lesson_ids):
+    rng = random.Random(opts.seed)
+    async def viewer(n):
+        return await fetch(port, f"/c/bench/stream/{rng.choice(lesson_ids[:opts.lessons])}", read_limit=opts.play_mb * 1048576, viewer=n)
+    return await asyncio.gather(*(viewer(n) for n in range(opts.viewers)))
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if ordered else 0.0
+
+def summarize(results, seconds):
+    ttfbs = [r["ttfb"] * 1000 for r in results]
+    served = sum(r["bytes"] for r in results)
+    return {
+        # A body that ends before the bytes asked for is a failed read, as it is for the player
+        "requests": len(results), "errors": sum(1 for r in results if r["status"] >= 400 or r["truncated"]),
+        "truncated": sum(1 for r in results if r["truncated"]),
+        "ttfb_ms": {"p50": round(percentile(ttfbs, 0.5), 2), "p90": round(percentile(ttfbs, 0.9), 2),
+                    "p99": round(percentile(ttfbs, 0.99), 2), "max": round(max(ttfbs, default=0), 2)},
+        "seconds": round(seconds, 3), "served_mb": round(served / 1048576, 2),
+        "throughput_mbps": round(served / 1048576 / seconds, 2) if seconds else 0.0,
+    }
+
+def run_workload(name, opts):
+    home = tempfile.mkdtemp(prefix=f"telo-bench-{name}-")
+    main = load_main(opts, home)
+    server, thread, port = start_server(main)
+    try:
+        async def drive():
+            if name == "index": return await run_index(opts, port, main)
+            lesson_ids = (await wait_indexed(port))["lesson_ids"]
+            fetched_before = dict(main.client.stats)
+            started = time.perf_counter()
+            results = await {"playback": run_playback, "seek": run_seek, "viewers": run_viewers}[name](opts, port, lesson_ids)
+            await asyncio.sleep(opts.settle)
+            report = summarize(results, time.perf_counter() - started)
+            report["upstream_mb"] = round((main.client.stats["bytes"] - fetched_before["bytes"]) / 1048576, 2)
+            report["upstream_requests"] = main.client.stats["requests"] - fetched_before["requests"]
+            return report
+        report = asyncio.run(drive())
+        report["flood_waits_injected"] = main.client.stats["flood_waits"]
+        report["server"] = {key: main.STREAM_STATS[key] for key in ("bytes_wasted", "aborted", "coalesced", "box_hits", "errors")}
+        report["cache_hit_ratio"] = round(main.CACHE_STATS["hits"] / max(1, main.CACHE_STATS["hits"] + main.CACHE_STATS["misses"]), 3)
+        # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        report["peak_rss_mb"] = round(peak_rss / 1048576, 1)
+        return report
+    finally:
+        server.should_exit = True
+        thread.join(10)
+
+# ru_maxrss is a lifetime peak, so every workload gets a fresh interpreter of its own
+def run_isolated(name, opts):
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_workload, (name, opts))
+
+# --- REPORTING ---
+def compare(results, baseline_path):
+    with open(baseline_path) as f: baseline = json.load(f)["workloads"]
+    print(f"\n📊 Compared with {baseline_path}")
+    for name, report in results.items():
+        if name not in baseline: continue
+        old = baseline[name]
+        for label, path in (("ttfb p50 ms", ("ttfb_ms", "p50")), ("ttfb p99 ms", ("ttfb_ms", "p99")), ("MB/s", ("throughput_mbps",)),
+                            ("upstream MB", ("upstream_mb",)), ("seconds", ("seconds",)), ("peak RSS MB", ("peak_rss_mb",))):
+            new_value, old_value = report, old
+            for key in path:
+                new_value, old_value = (new_value or {}).get(key), (old_value or {}).get(key)
+            if new_value is None or old_value is None: continue
+            change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else "n/a"
+            print(f"   {name:<9} {label:<12} {old_value:>10} → {new_value:<10} ({change})")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline TELO streaming/indexing benchmark with a simulated Telegram.")
+    parser.add_argument("workloads", nargs="*", help=f"any of {', '.join(WORKLOADS)} (default: all)")
+    parser.add_argument("--main", default=MAIN_PY, help="main.py to benchmark (default: .course/main.py)")
+    parser.add_argument("--messages", type=int, default=2000, help="synthetic channel size")
+    parser.add_argument("--module-every", type=int, default=10, help="one module header every N messages")
+    parser.add_argument("--video-mb", type=int, default=64, help="size of every lesson video")
+    parser.add_argument("--faststart", action="store_true", help="moov before mdat (default: moov at the end)")
+    parser.add_argument("--latency-ms", type=float, default=60.0, help="round trip per Telegram request")
+    parser.add_argument("--bandwidth-mbps", type=float, default=40.0, help="shared Telegram link, MB/s")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of requests failing with FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=2)
+    parser.add_argument("--lessons", type=int, default=5, help="lessons the streaming workloads pick from")
+    parser.add_argument("--play-mb", type=int, default=16, help="bytes read per playback request")
+    parser.add_argument("--seeks", type=int, default=40)
+    parser.add_argument("--seek-read-kb", type=int, default=512, help="bytes read after each seek before hanging up")
+    parser.add_argument("--viewers", type=int, default=20)
+    parser.add_argument("--settle", type=float, default=0.5, help="seconds to let read-ahead finish before counting upstream bytes")
+    parser.add_argument("--iter-download", action="store_true", help="use the single-connection iter_download path")
+    parser.add_argument("--config", default="{}", help="JSON merged into main.CONFIG, e.g. '{\"download_connections\": 8}'")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--verbose", action="store_true", help="keep the server's own log output")
+    opts = parser.parse_args()
+    unknown = set(opts.workloads) - set(WORKLOADS)
+    if unknown: parser.error(f"unknown workload(s): {', '.join(sorted(unknown))}")
+    return opts
+
+def main():
+    opts = parse_args()
+    results = {}
+    for name in dict.fromkeys(opts.workloads or WORKLOADS):
+        print(f"⏱️  {name}...", flush=True)
+        results[name] = run_isolated(name, opts)
+        print(f"   {json.dumps(results[name])}")
+    params = {key: value for key, value in vars(opts).items() if key not in ("out", "compare", "verbose", "workloads")}
+    with open(opts.out, "w") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0], "params": params, "workloads": results}, f, indent=2)
+    print(f"💾 Results saved to {opts.out}")
+    if opts.compare: compare(results, opts.compare)
+
+if __name__ == "__main__":
+    main()
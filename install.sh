@@ -17,10 +17,15 @@ echo "📦 Dependencies install ho rahi hain..."
 pip3 install -r requirements.txt
 
 # 3. Zsh Shortcuts (Aliases) add karna automatically
+# A function written by an earlier install is replaced, so upgrades get the new commands too
+if grep -q "^# === TELO ENGINE ALIASES ===$" ~/.zshrc 2>/dev/null; then
+    echo "♻️ Replacing the existing 'telo' function in ~/.zshrc..."
+    sed -i.bak '/^# === TELO ENGINE ALIASES ===$/,/^}$/d' ~/.zshrc
+fi
 # Check if alias already exists to avoid duplication
-if ! grep -q "telo()" ~/.zshrc; then
+if ! grep -q "telo()" ~/.zshrc 2>/dev/null; then
     echo "✍️ Adding 'telo' function to ~/.zshrc..."
-    echo "" >> ~/.zshrc
+    [ -n "$(tail -n 1 ~/.zshrc 2>/dev/null)" ] && echo "" >> ~/.zshrc
     echo "# === TELO ENGINE ALIASES ===" >> ~/.zshrc
     echo 'telo() {
     case $1 in
@@ -33,11 +38,20 @@ if ! grep -q "telo()" ~/.zshrc; then
         play)
             python3 ~/.course/main.py open "${@:2}"
             ;;
+        reindex)
+            python3 ~/.course/main.py reindex "${@:2}"
+            ;;
         login)
             python3 ~/.course/main.py login "${@:2}"
             ;;
+        stop)
+            python3 ~/.course/main.py stop
+            ;;
+        download)
+            python3 ~/.course/main.py download "${@:2}"
+            ;;
         *)
-            echo "Usage: telo {add|list|play|login}"
+            echo "Usage: telo {add|list|play|reindex|download|login|stop}"
             echo "Example: telo play '\''React Tutorial'\''"
             ;;
     esac